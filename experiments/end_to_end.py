@@ -2,17 +2,27 @@ import argparse
 import networkx as nx
 import numpy as np
 from tqdm import tqdm
-from scipy.optimize import minimize
+from scipy.optimize import OptimizeResult, minimize
+from concurrent.futures import ProcessPoolExecutor
 import json
+import os
 
 import path
 
-from qiskit.circuit import Parameter
 from qiskit import Aer
 from qiskit_aer import AerError
 
-from qaoa_util import compute_expectation, create_qaoa_circ
+from qaoa_util import (
+    compute_expectation_int,
+    evaluate_landscape_adaptive,
+    get_lightcone_expectation,
+    get_parameter_shift_gradient,
+    qaoa_expectation,
+    qaoa_gradient,
+    qaoa_template,
+)
 from red_qaoa import red_qaoa_exe
+from angle_db import AngleDatabase
 
 
 def get_args():
@@ -26,63 +36,378 @@ def get_args():
     parser.add_argument(
         "--num_nodes", type=int, default=30, help="number of nodes in the graph"
     )
+    parser.add_argument(
+        "--degree",
+        type=int,
+        default=None,
+        help="test random regular graphs of this degree instead of G(n, 0.5) "
+        "graphs, whose sparse light cones suit --simulator lightcone",
+    )
     parser.add_argument("--shots", type=int, default=8192, help="number of shots")
+    parser.add_argument(
+        "--target_sem",
+        type=float,
+        default=None,
+        help="sample each evaluation in growing batches until the standard "
+        "error of the expectation falls below this value, using at most --shots",
+    )
     parser.add_argument("--use_gpu", action="store_true", help="use GPU backend")
+    parser.add_argument(
+        "--simulator",
+        type=str,
+        default="aer",
+        choices=["aer", "numpy", "lightcone"],
+        help="sampled Aer simulation, exact NumPy statevector simulation, "
+        "or exact per-edge light cone simulation",
+    )
+    parser.add_argument(
+        "--symmetric",
+        action="store_true",
+        help="exploit the global bit flip symmetry of MaxCut in the numpy "
+        "and lightcone simulators",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes running optimization restarts in parallel",
+    )
+    parser.add_argument(
+        "--optimizer",
+        type=str,
+        default="COBYLA",
+        choices=["COBYLA", "L-BFGS-B", "adam"],
+        help="derivative-free COBYLA, or a gradient-based optimizer using "
+        "adjoint gradients for numpy and lightcone and parameter shifts for aer",
+    )
+    parser.add_argument(
+        "--learning_rate", type=float, default=0.05, help="step size of Adam"
+    )
+    parser.add_argument(
+        "--warm_start",
+        action="store_true",
+        help="refine the reduced graph optimum on the full graph and compare "
+        "its full-graph evaluations with the cold start",
+    )
+    parser.add_argument(
+        "--warm_rhobeg",
+        type=float,
+        default=0.2,
+        help="initial COBYLA step of the warm-started refinement",
+    )
+    parser.add_argument(
+        "--warm_tol",
+        type=float,
+        default=1e-3,
+        help="COBYLA tolerance of the warm-started refinement",
+    )
+    parser.add_argument(
+        "--restarts",
+        type=int,
+        default=None,
+        help="optimization restarts per graph (default: 20, 50 or 100 by p)",
+    )
+    parser.add_argument(
+        "--angle_db",
+        type=str,
+        default=None,
+        help="start from the best angles stored for the most similar graphs "
+        "in this database, and store the angles found by this run",
+    )
+    parser.add_argument(
+        "--traces",
+        type=str,
+        default=None,
+        help="save the objective trace of every restart to this JSON file",
+    )
 
     return parser.parse_args()
 
 
+def get_backend(gpu, threads=0):
+    backend = Aer.get_backend("qasm_simulator")
+    backend.set_options(max_parallel_threads=threads)
+
+    if gpu:
+        try:
+            backend.set_options(device="GPU")
+        except AerError as e:
+            print(e)
+
+    return backend
+
+
 def get_expectation(
     G,
     p,
     shots,
     gpu,
+    simulator="aer",
+    symmetric=False,
+    target_sem=None,
+    shots_used=None,
+    backend=None,
+    gradient=False,
 ):
-    parameters = [Parameter("theta" + str(i)) for i in range(2 * p)]
+    if simulator == "numpy":
 
-    circuit = create_qaoa_circ(parameters, G)
+        def simulate_circ(theta):
+            if gradient:
+                return qaoa_gradient(np.array(theta, dtype=np.float64), G)
+            return qaoa_expectation(np.array(theta), G, symmetric)
 
-    backend = Aer.get_backend("qasm_simulator")
+        return simulate_circ
 
-    if gpu:
-        try:
-            backend.set_options(device="GPU")
-        except AerError as e:
-            print(e)
+    if simulator == "lightcone":
+        return get_lightcone_expectation(
+            G, p, symmetric=symmetric, gradient=gradient
+        )
+
+    if backend is None:
+        backend = get_backend(gpu)
+
+    if gradient:
+        execute_shifts = get_parameter_shift_gradient(G, p, backend, shots)
+        circuits = 1 + 2 * p * (G.number_of_nodes() + G.number_of_edges())
+
+        def execute_grad(theta):
+            if shots_used is not None:
+                shots_used.append(circuits * shots)
+            return execute_shifts(theta)
+
+        return execute_grad
+
+    circuit, parameters = qaoa_template(G, p)
 
     def execute_circ(theta):
         theta = np.array(theta)
 
+        if target_sem is not None:
+            exps, shots_per_point = evaluate_landscape_adaptive(
+                circuit,
+                backend,
+                G,
+                parameters,
+                theta,
+                target_sem,
+                max_shots=shots,
+            )
+            if shots_used is not None:
+                shots_used.append(shots_per_point[0])
+            return exps[0]
+
+        if shots_used is not None:
+            shots_used.append(shots)
+
         counts = (
             backend.run(
-                circuit.bind_parameters(
-                    {parameters[i]: theta[i] for i in range(2 * p)}
-                ),
+                circuit,
+                parameter_binds=[{parameters[i]: [theta[i]] for i in range(2 * p)}],
                 shots=shots,
             )
             .result()
-            .get_counts()
+            .data()["counts"]
         )
 
-        return compute_expectation(counts, G)
+        return compute_expectation_int(counts, G)
 
     return execute_circ
 
 
-def perform_optimization(args, graph, red_graph):
-    get_exps = get_expectation(graph, args.p, args.shots, args.use_gpu)
-    get_exps_red = get_expectation(red_graph, args.p, args.shots, args.use_gpu)
+def adam(fun, x0, learning_rate=0.05, maxiter=500, gtol=1e-4):
+    """
+    Minimizes fun, which returns the value and the gradient, with Adam,
+    and returns the best evaluated point
+    """
+    x = np.array(x0, dtype=np.float64)
+    m = np.zeros_like(x)
+    v = np.zeros_like(x)
+    beta1, beta2, eps = 0.9, 0.999, 1e-8
+    best_x, best_value = x, np.inf
+
+    for nit in range(1, maxiter + 1):
+        value, grad = fun(x)
+        if value < best_value:
+            best_x, best_value = x, value
+        if np.linalg.norm(grad) < gtol:
+            break
+
+        m = beta1 * m + (1 - beta1) * grad
+        v = beta2 * v + (1 - beta2) * grad**2
+        m_hat = m / (1 - beta1**nit)
+        v_hat = v / (1 - beta2**nit)
+        x = x - learning_rate * m_hat / (np.sqrt(v_hat) + eps)
+
+    return OptimizeResult(x=best_x, fun=best_value, nfev=nit, nit=nit)
+
+
+def optimize(fun, x0, optimizer="COBYLA", learning_rate=0.05, tol=None, rhobeg=None):
+    if optimizer == "adam":
+        return adam(fun, x0, learning_rate)
+
+    if optimizer == "COBYLA":
+        options = {} if rhobeg is None else {"rhobeg": rhobeg}
+        return minimize(fun, x0, method="COBYLA", tol=tol, options=options)
+
+    return minimize(fun, x0, method=optimizer, jac=True, tol=tol)
+
+
+def perform_optimization(
+    get_exps,
+    get_exps_red,
+    x0,
+    warm_rhobeg=None,
+    warm_tol=None,
+    optimizer="COBYLA",
+    learning_rate=0.05,
+    get_value=None,
+):
+    baseline_trace = []
+    red_qaoa_trace = []
+    warm_trace = []
+
+    # Gradient-based optimizers get the value and the gradient
+    gradient = optimizer != "COBYLA"
+
+    def traced(get_exps, trace):
+        def wrapper(theta):
+            value = get_exps(theta)
+            trace.append(float(value[0] if gradient else value))
+            return value
+
+        return wrapper
+
+    if get_value is None:
+        # Full graph value alone, to score the reduced graph optimum
+        def get_value(theta):
+            return get_exps(theta)[0] if gradient else get_exps(theta)
 
-    # Define the initial guess for the minimum
-    x0 = np.random.rand(args.p * 2) * np.pi
     # Minimize the function
-    baseline_result = minimize(get_exps, x0, method="COBYLA")
-    red_qaoa_result = minimize(get_exps_red, x0, method="COBYLA")
+    baseline_result = optimize(
+        traced(get_exps, baseline_trace), x0, optimizer, learning_rate
+    )
+    red_qaoa_result = optimize(
+        traced(get_exps_red, red_qaoa_trace), x0, optimizer, learning_rate
+    )
 
-    baseline_fun = baseline_result.fun
-    red_qaoa_fun = get_exps(red_qaoa_result.x)
+    result = {
+        "x0": x0.tolist(),
+        "baseline_x": baseline_result.x.tolist(),
+        "baseline_fun": float(baseline_result.fun),
+        "red_qaoa_x": red_qaoa_result.x.tolist(),
+        "red_qaoa_red_fun": float(red_qaoa_result.fun),
+        "red_qaoa_fun": float(get_value(red_qaoa_result.x)),
+        "baseline_trace": baseline_trace,
+        "red_qaoa_trace": red_qaoa_trace,
+    }
 
-    return baseline_fun, red_qaoa_fun
+    if warm_rhobeg is not None:
+        # Refine the reduced graph optimum on the full graph with short steps
+        warm_result = optimize(
+            traced(get_exps, warm_trace),
+            red_qaoa_result.x,
+            optimizer,
+            learning_rate,
+            tol=warm_tol,
+            rhobeg=warm_rhobeg,
+        )
+        result["warm_x"] = warm_result.x.tolist()
+        result["warm_fun"] = float(warm_result.fun)
+        result["warm_trace"] = warm_trace
+
+    return result
+
+
+# Per-process state of the restart workers, so every worker builds one
+# backend and one parameterized circuit per graph and reuses them
+_worker = {}
+
+
+def _init_worker(args, graph, red_graph, threads=0):
+    backend = None
+    if args.simulator == "aer":
+        backend = get_backend(args.use_gpu, threads)
+
+    shots_used = []
+    _worker["shots_used"] = shots_used
+    _worker["warm_rhobeg"] = args.warm_rhobeg if args.warm_start else None
+    _worker["warm_tol"] = args.warm_tol
+    _worker["optimizer"] = args.optimizer
+    _worker["learning_rate"] = args.learning_rate
+    _worker["get_exps"], _worker["get_exps_red"] = [
+        get_expectation(
+            g,
+            args.p,
+            args.shots,
+            args.use_gpu,
+            args.simulator,
+            args.symmetric,
+            args.target_sem,
+            shots_used,
+            backend,
+            args.optimizer != "COBYLA",
+        )
+        for g in (graph, red_graph)
+    ]
+
+    # Score the reduced graph optimum without computing a gradient
+    _worker["get_value"] = None
+    if args.optimizer != "COBYLA":
+        _worker["get_value"] = get_expectation(
+            graph,
+            args.p,
+            args.shots,
+            args.use_gpu,
+            args.simulator,
+            args.symmetric,
+            args.target_sem,
+            shots_used,
+            backend,
+        )
+
+
+def _restart(x0):
+    _worker["shots_used"].clear()
+    result = perform_optimization(
+        _worker["get_exps"],
+        _worker["get_exps_red"],
+        x0,
+        _worker["warm_rhobeg"],
+        _worker["warm_tol"],
+        _worker["optimizer"],
+        _worker["learning_rate"],
+        _worker["get_value"],
+    )
+    result["shots"] = int(np.sum(_worker["shots_used"]))
+    result["evaluations"] = len(_worker["shots_used"])
+    return result
+
+
+def multi_start(args, graph, red_graph, x0s, workers=1):
+    """
+    Runs one restart with args.optimizer on the graph and the reduced graph
+    per initial point, concurrently on a pool of workers, and returns every
+    restart
+    """
+    if workers <= 1:
+        _init_worker(args, graph, red_graph)
+        return [_restart(x0) for x0 in tqdm(x0s, leave=False, desc="restarts")]
+
+    # Split the cores between workers, Aer uses all of them by default
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(
+        workers,
+        initializer=_init_worker,
+        initargs=(args, graph, red_graph, threads),
+    ) as executor:
+        return list(
+            tqdm(
+                executor.map(_restart, x0s),
+                total=len(x0s),
+                leave=False,
+                desc="restarts",
+            )
+        )
 
 
 def main():
@@ -90,31 +415,91 @@ def main():
     args = get_args()
 
     restarts = 20 if args.p == 1 else 50 if args.p == 2 else 100
+    if args.restarts is not None:
+        restarts = args.restarts
+
+    angle_db = None
+    if args.angle_db is not None:
+        angle_db = AngleDatabase(args.angle_db)
 
     # create testing and red-qaoa graph
-    testing_graphs = [
-        nx.gnp_random_graph(args.num_nodes, 0.5) for _ in range(args.num_graphs)
-    ]
+    if args.degree is not None:
+        testing_graphs = [
+            nx.random_regular_graph(args.degree, args.num_nodes)
+            for _ in range(args.num_graphs)
+        ]
+    else:
+        testing_graphs = [
+            nx.gnp_random_graph(args.num_nodes, 0.5) for _ in range(args.num_graphs)
+        ]
 
     ratio_average = []
     ratio_optimal = []
+    shots_used = []
+    evaluations = []
+    baseline_nfevs = []
+    traces = []
+    cold_evaluations = []
+    warm_evaluations = []
+    warm_ratios = []
 
     for graph in tqdm(testing_graphs, desc="Testing graphs"):
         red_graph = red_qaoa_exe(graph)
 
-        baseline_funs = []
-        red_qaoa_funs = []
-        for _ in tqdm(range(restarts), leave=False, desc="restarts"):
-            baseline_fun, red_qaoa_fun = perform_optimization(args, graph, red_graph)
-
-            baseline_funs.append(baseline_fun)
-            red_qaoa_funs.append(red_qaoa_fun)
+        # Define the initial guesses for the minimum
+        x0s = [np.random.rand(args.p * 2) * np.pi for _ in range(restarts)]
+        if angle_db is not None:
+            # Replace the first random guesses with angles of similar graphs
+            for i, angles in enumerate(angle_db.lookup(graph, args.p, restarts)):
+                x0s[i] = angles
+        results = multi_start(args, graph, red_graph, x0s, args.workers)
+
+        baseline_funs = [result["baseline_fun"] for result in results]
+        red_qaoa_funs = [result["red_qaoa_fun"] for result in results]
+        shots_used.extend(result["shots"] for result in results)
+        evaluations.extend(result["evaluations"] for result in results)
+        traces.append(results)
+
+        baseline_nfevs.extend(len(result["baseline_trace"]) for result in results)
+
+        if angle_db is not None:
+            # Store the best angles found for the graph and the reduced graph
+            for g, name, fun in [
+                (graph, "baseline", "baseline_fun"),
+                (red_graph, "red_qaoa", "red_qaoa_red_fun"),
+            ] + ([(graph, "warm", "warm_fun")] if args.warm_start else []):
+                best = min(results, key=lambda result: result[fun])
+                angle_db.put(g, args.p, best[f"{name}_x"], best[fun])
+
+        if args.warm_start:
+            for result in results:
+                cold_evaluations.append(len(result["baseline_trace"]))
+                warm_evaluations.append(len(result["warm_trace"]))
+                warm_ratios.append(result["warm_fun"] / result["baseline_fun"])
 
         ratio_average.append(np.mean(red_qaoa_funs) / np.mean(baseline_funs))
         ratio_optimal.append(np.min(red_qaoa_funs) / np.min(baseline_funs))
 
     print(f"Optimal ratio: {np.mean(ratio_optimal)}")
     print(f"Average ratio: {np.mean(ratio_average)}")
+    print(f"Baseline evaluations per restart: {np.mean(baseline_nfevs):.1f}")
+    if np.sum(shots_used) > 0:
+        print(
+            f"Shots: {np.sum(shots_used)} total, "
+            f"{np.sum(shots_used) / np.sum(evaluations):.1f} mean per evaluation"
+        )
+
+    if args.warm_start:
+        saved = 1 - np.sum(warm_evaluations) / np.sum(cold_evaluations)
+        print(
+            f"Full-graph evaluations: {np.mean(cold_evaluations):.1f} cold start, "
+            f"{np.mean(warm_evaluations):.1f} warm start ({saved:.1%} saved)"
+        )
+        print(f"Warm start ratio: {np.mean(warm_ratios)}")
+
+    if args.traces is not None:
+        with open(args.traces, "w") as file:
+            json.dump(traces, file)
 
     new_results = {
         args.p: [
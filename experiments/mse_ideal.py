@@ -5,24 +5,47 @@ from tqdm import tqdm
 
 import path
 
-from qiskit.circuit import Parameter
 from qiskit import Aer
 from qiskit_aer import AerSimulator, AerError
 
-from qaoa_util import compute_expectation, create_qaoa_circ
-from red_qaoa import red_qaoa_exe
+from qaoa_util import (
+    evaluate_landscape,
+    evaluate_landscape_adaptive,
+    p1_expectation,
+    qaoa_expectation,
+    qaoa_template,
+)
+from red_qaoa import red_qaoa_batch
+from reduction_cache import ReductionCache
 import json
 
 
-def get_sampled_landscape(circ, backend, graph, thetas, theta_vals, shots, taskname):
-    exps = []
-
-    for theta in tqdm(theta_vals, desc=taskname):
-        binded_circ = circ.bind_parameters({k: v for k, v in zip(thetas, theta)})
+def get_sampled_landscape(
+    circ, backend, graph, thetas, theta_vals, shots, taskname, target_sem=None
+):
+    if target_sem is None:
+        exps = evaluate_landscape(
+            circ, backend, graph, thetas, theta_vals, shots, desc=taskname
+        )
+        return exps, np.full(len(exps), shots)
+
+    return evaluate_landscape_adaptive(
+        circ,
+        backend,
+        graph,
+        thetas,
+        theta_vals,
+        target_sem,
+        max_shots=shots,
+        desc=taskname,
+    )
 
-        counts = backend.run(binded_circ, shots=shots).result().get_counts()
 
-        exps.append(compute_expectation(counts, graph))
+def get_exact_landscape(graph, theta_vals, taskname, symmetric=False):
+    exps = [
+        qaoa_expectation(theta, graph, symmetric)
+        for theta in tqdm(theta_vals, desc=taskname)
+    ]
 
     return np.array(exps)
 
@@ -43,7 +66,40 @@ def get_args():
         "--num_graphs", type=int, default=100, help="number of graphs to test"
     )
     parser.add_argument("--shots", type=int, default=8192, help="number of shots")
+    parser.add_argument(
+        "--target_sem",
+        type=float,
+        default=None,
+        help="sample each point in growing batches until the standard error "
+        "of its expectation falls below this value, using at most --shots",
+    )
     parser.add_argument("--use_gpu", action="store_true", help="use GPU backend")
+    parser.add_argument(
+        "--simulator",
+        type=str,
+        default="aer",
+        choices=["aer", "numpy", "analytic"],
+        help="sampled Aer simulation, exact NumPy statevector simulation, "
+        "or the closed-form p=1 expectation",
+    )
+    parser.add_argument(
+        "--symmetric",
+        action="store_true",
+        help="exploit the global bit flip symmetry of MaxCut in the numpy "
+        "simulator",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="number of processes for graph reduction (default: all cores)",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="random seed for graph reduction"
+    )
+    parser.add_argument(
+        "--no_cache", action="store_true", help="do not reuse cached reductions"
+    )
 
     parser.add_argument(
         "--min_nodes", type=int, default=0, help="minimum number of nodes"
@@ -52,7 +108,12 @@ def get_args():
         "--max_nodes", type=int, default=10, help="maximum number of nodes"
     )
 
-    return parser.parse_args()
+    args = parser.parse_args()
+
+    if args.simulator == "analytic" and args.p != 1:
+        parser.error("--simulator analytic requires --p 1")
+
+    return args
 
 
 def get_graphs(graph_set, num_graphs, min_nodes, max_nodes):
@@ -90,15 +151,33 @@ def main():
         except AerError as e:
             print(e)
 
+    # reduce all graphs up front on a process pool
+    cache = ReductionCache(enabled=not args.no_cache)
+    red_graphs = [None] * len(testing_graphs)
+    reduction_times = []
+    for i, red_graph, seconds in tqdm(
+        red_qaoa_batch(
+            testing_graphs, workers=args.workers, seed=args.seed, cache=cache
+        ),
+        total=len(testing_graphs),
+        desc="Graph Reduction",
+    ):
+        red_graphs[i] = red_graph
+        reduction_times.append(seconds)
+
+    print(
+        f"Reduction Time: {np.sum(reduction_times):.3f}s total, "
+        f"{np.mean(reduction_times):.3f}s mean, {np.max(reduction_times):.3f}s max"
+    )
+
     node_reductions = []
     edge_reductions = []
     mse = []
+    shots_used = []
 
     theta_vals = np.random.uniform(0, 2 * np.pi, (args.num_points, 2 * args.p))
 
-    for i, graph in enumerate(testing_graphs):
-        red_graph = red_qaoa_exe(graph)
-
+    for i, (graph, red_graph) in enumerate(zip(testing_graphs, red_graphs)):
         node_reductions.append(
             1 - red_graph.number_of_nodes() / graph.number_of_nodes()
         )
@@ -106,32 +185,50 @@ def main():
             1 - red_graph.number_of_edges() / graph.number_of_edges()
         )
 
-        # create 1-layer qaoa circuits
-        theta_names = [f"theta_{i}" for i in range(2 * args.p)]
-        thetas = [Parameter(theta_name) for theta_name in theta_names]
-
-        circ = create_qaoa_circ(thetas, graph)
-        circ_red_qaoa = create_qaoa_circ(thetas, red_graph)
-
-        baseline_landscape = get_sampled_landscape(
-            circ,
-            ideal_backend,
-            graph,
-            thetas,
-            theta_vals,
-            args.shots,
-            f"Ideal Landscape {i+1}",
-        )
-
-        red_qaoa_landscape = get_sampled_landscape(
-            circ_red_qaoa,
-            ideal_backend,
-            red_graph,
-            thetas,
-            theta_vals,
-            args.shots,
-            f"Red-QAOA Landscape {i+1}",
-        )
+        if args.simulator == "analytic":
+            baseline_landscape = p1_expectation(
+                theta_vals[:, 0], theta_vals[:, 1], graph
+            )
+            red_qaoa_landscape = p1_expectation(
+                theta_vals[:, 0], theta_vals[:, 1], red_graph
+            )
+        elif args.simulator == "numpy":
+            baseline_landscape = get_exact_landscape(
+                graph, theta_vals, f"Ideal Landscape {i+1}", args.symmetric
+            )
+
+            red_qaoa_landscape = get_exact_landscape(
+                red_graph, theta_vals, f"Red-QAOA Landscape {i+1}", args.symmetric
+            )
+        else:
+            # create p-layer qaoa circuits
+            circ, thetas = qaoa_template(graph, args.p)
+            circ_red_qaoa, thetas_red_qaoa = qaoa_template(red_graph, args.p)
+
+            baseline_landscape, baseline_shots = get_sampled_landscape(
+                circ,
+                ideal_backend,
+                graph,
+                thetas,
+                theta_vals,
+                args.shots,
+                f"Ideal Landscape {i+1}",
+                args.target_sem,
+            )
+
+            red_qaoa_landscape, red_qaoa_shots = get_sampled_landscape(
+                circ_red_qaoa,
+                ideal_backend,
+                red_graph,
+                thetas_red_qaoa,
+                theta_vals,
+                args.shots,
+                f"Red-QAOA Landscape {i+1}",
+                args.target_sem,
+            )
+
+            shots_used.extend(baseline_shots)
+            shots_used.extend(red_qaoa_shots)
 
         baseline_landscape /= baseline_landscape.min()
         red_qaoa_landscape /= red_qaoa_landscape.min()
@@ -141,6 +238,11 @@ def main():
     print(f"Node Reduction: {np.mean(node_reductions)}")
     print(f"Edge Reduction: {np.mean(edge_reductions)}")
     print(f"MSE: {np.mean(mse)}")
+    if shots_used:
+        print(
+            f"Shots: {np.sum(shots_used)} total, "
+            f"{np.mean(shots_used):.1f} mean per point"
+        )
 
     new_results_key = f"{args.graph_set}_{args.p}"
 
@@ -2,41 +2,158 @@ import argparse
 import networkx as nx
 import numpy as np
 from tqdm import tqdm
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+import hashlib
+import multiprocessing
+import os
 
 import path
 import json
 
-from qiskit.circuit import Parameter
-from qiskit import Aer, transpile
+from qiskit import Aer, qpy, transpile
 from qiskit.providers.fake_provider import FakeToronto
 from qiskit_aer import AerSimulator, AerError
 
-from qaoa_util import compute_expectation, create_qaoa_circ
+from io_util import atomic_write
+from qaoa_util import evaluate_landscape, p1_expectation, qaoa_template
 from red_qaoa import red_qaoa_exe
 
 
-def grid_search(circ, backend, graph, thetas, shots, width, taskname):
-    # Create a grid of search points in range [0, pi]
-    beta_vals = np.linspace(0, np.pi, width)
-    gamma_vals = np.linspace(0, 2 * np.pi, width)
+def get_backend(kind, use_gpu=False, threads=0):
+    if kind == "ideal":
+        backend = Aer.get_backend("qasm_simulator", device="CPU")
+    else:
+        device_backend = FakeToronto()
+        backend = AerSimulator.from_backend(device_backend, method="density_matrix")
 
-    exps = []
+        if use_gpu:
+            try:
+                backend.set_options(device="GPU")
+            except AerError as e:
+                print(e)
 
-    for x in tqdm(gamma_vals, desc=taskname):
-        sub_exps = []
+    backend.set_options(max_parallel_threads=threads)
+    return backend
 
-        for y in tqdm(beta_vals, leave=False):
-            params = [x, y]
 
-            binded_circ = circ.bind_parameters({k: v for k, v in zip(thetas, params)})
+# Per-process state of the grid search workers, so every worker builds its
+# backend once and receives the circuit once instead of with every row
+_worker = {}
 
-            counts = backend.run(binded_circ, shots=shots).result().get_counts()
 
-            sub_exps.append(compute_expectation(counts, graph))
+def _init_worker(circ, graph, thetas, shots, kind, use_gpu, threads):
+    _worker.update(
+        circ=circ,
+        graph=graph,
+        thetas=thetas,
+        shots=shots,
+        backend=get_backend(kind, use_gpu, threads),
+    )
 
-        exps.append(sub_exps)
 
-    return np.array(exps)
+def _grid_row(row, params):
+    exps = evaluate_landscape(
+        _worker["circ"],
+        _worker["backend"],
+        _worker["graph"],
+        _worker["thetas"],
+        params,
+        _worker["shots"],
+        chunk_size=len(params),
+    )
+    return row, exps
+
+
+def load_checkpoint(checkpoint_path, settings):
+    try:
+        with open(checkpoint_path, "r") as file:
+            state = json.load(file)
+    except FileNotFoundError:
+        return {"settings": settings, "landscapes": {}}
+
+    if state["settings"] != settings:
+        raise ValueError(
+            f"checkpoint {checkpoint_path} was written with different settings"
+        )
+
+    return state
+
+
+def save_checkpoint(checkpoint_path, state):
+    atomic_write(checkpoint_path, lambda file: json.dump(state, file))
+
+
+def grid_search(
+    circ,
+    backend_kind,
+    graph,
+    thetas,
+    shots,
+    width,
+    taskname,
+    workers=1,
+    use_gpu=False,
+    state=None,
+    checkpoint=None,
+):
+    # Create a grid of search points in range [0, pi]
+    beta_vals = np.linspace(0, np.pi, width)
+    gamma_vals = np.linspace(0, 2 * np.pi, width)
+
+    params = np.array([[x, y] for x in gamma_vals for y in beta_vals])
+    params = params.reshape(width, width, 2)
+
+    # Rows finished by an earlier run are taken from the checkpoint state
+    rows = {}
+    if state is not None:
+        rows = state["landscapes"].setdefault(taskname, {})
+    todo = [row for row in range(width) if str(row) not in rows]
+
+    def finish(row, exps):
+        rows[str(row)] = exps.tolist()
+        if checkpoint is not None:
+            save_checkpoint(checkpoint, state)
+        progress.update()
+
+    progress = tqdm(total=width, initial=width - len(todo), desc=taskname)
+
+    # Split the cores between workers, Aer uses all of them by default
+    threads = max(1, (os.cpu_count() or 1) // workers) if workers > 1 else 0
+    initargs = (circ, graph, thetas, shots, backend_kind, use_gpu, threads)
+
+    if workers <= 1 or len(todo) <= 1:
+        _init_worker(*initargs)
+        for row in todo:
+            finish(*_grid_row(row, params[row]))
+    else:
+        with ProcessPoolExecutor(
+            workers, initializer=_init_worker, initargs=initargs
+        ) as executor:
+            # Keep at most two rows per worker in flight to bound memory
+            todo = iter(todo)
+            pending = {
+                executor.submit(_grid_row, row, params[row])
+                for row in islice(todo, 2 * workers)
+            }
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(*future.result())
+                for row in islice(todo, len(done)):
+                    pending.add(executor.submit(_grid_row, row, params[row]))
+
+    progress.close()
+
+    return np.array([rows[str(row)] for row in range(width)])
+
+
+def analytic_grid(graph, width):
+    # Same grid as grid_search, which binds gamma_vals to theta_0 and beta_vals to theta_1
+    beta_vals = np.linspace(0, np.pi, width)
+    gamma_vals = np.linspace(0, 2 * np.pi, width)
+
+    return p1_expectation(gamma_vals[:, None], beta_vals[None, :], graph)
 
 
 def get_args():
@@ -47,67 +164,237 @@ def get_args():
     parser.add_argument("--width", type=int, default=32, help="width of search grid")
     parser.add_argument("--shots", type=int, default=8192, help="number of shots")
     parser.add_argument("--use_gpu", action="store_true", help="use GPU backend")
+    parser.add_argument(
+        "--edge_coloring",
+        action="store_true",
+        help="layer the problem unitary by an edge coloring",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes evaluating grid rows in parallel",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default=None,
+        help="save finished grid rows to this file and resume from it",
+    )
+    parser.add_argument(
+        "--trials",
+        type=int,
+        default=100,
+        help="number of seeded SABRE transpilations to pick the shallowest from",
+    )
+    parser.add_argument(
+        "--no_cache", action="store_true", help="do not reuse cached transpilations"
+    )
+    parser.add_argument(
+        "--analytic_ideal",
+        action="store_true",
+        help="compute the ideal landscape with the closed-form p=1 expectation",
+    )
 
     return parser.parse_args()
 
 
-def transpile_circuit(circ, backend):
-    min_depth = 100000
-    min_circ = None
+# Content hash of a circuit's instructions, independent of parameter identity
+def _circuit_hash(circ):
+    payload = json.dumps(
+        [
+            circ.num_qubits,
+            [
+                [
+                    inst.operation.name,
+                    [circ.find_bit(qubit).index for qubit in inst.qubits],
+                    [str(param) for param in inst.operation.params],
+                ]
+                for inst in circ.data
+            ],
+        ]
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
 
-    for _ in range(100):
-        temp_circ = transpile(circ, backend=backend, routing_method="sabre")
-        if temp_circ.depth() < min_depth:
-            min_depth = temp_circ.depth()
-            min_circ = temp_circ
-    return min_circ
 
+# Per-process circuit and backend of the transpilation workers
+_trial = {}
 
-def main():
-    # parse arguments
-    args = get_args()
 
-    # create testing and red-qaoa graph
-    graph = nx.gnp_random_graph(args.n, 0.5)
-    red_graph = red_qaoa_exe(graph)
+def _init_trial(circ, backend):
+    _trial.update(circ=circ, backend=backend)
+
 
-    # create ideal and noisy circuit simulators
-    ideal_backend = Aer.get_backend("qasm_simulator", device="CPU")
+def _trial_depth(seed):
+    temp_circ = transpile(
+        _trial["circ"],
+        backend=_trial["backend"],
+        routing_method="sabre",
+        seed_transpiler=seed,
+    )
+    return temp_circ.depth(), seed
+
+
+def transpile_circuit(
+    circ, backend, trials=100, workers=1, cache_dir=".red_qaoa_cache/transpiled"
+):
+    name = backend.name() if callable(backend.name) else backend.name
+    key = hashlib.sha256(
+        json.dumps([_circuit_hash(circ), name, trials]).encode()
+    ).hexdigest()
+
+    if os.environ.get("RED_QAOA_NO_CACHE"):
+        cache_dir = None
+    cache_path = None if cache_dir is None else os.path.join(cache_dir, key + ".qpy")
+
+    parameters = {param.name: param for param in circ.parameters}
+
+    if cache_path is not None and os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            min_circ = qpy.load(f)[0]
+
+        # Rebind the loaded parameters to the caller's parameter objects
+        return min_circ.assign_parameters(
+            {param: parameters[param.name] for param in min_circ.parameters}
+        )
+
+    # Run the seeded SABRE trials, then redo the shallowest one
+    if workers <= 1:
+        _init_trial(circ, backend)
+        depths = [_trial_depth(seed) for seed in range(trials)]
+    else:
+        # SABRE runs on Rust threads that do not survive a fork, so spawn
+        with ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_trial,
+            initargs=(circ, backend),
+        ) as executor:
+            depths = list(executor.map(_trial_depth, range(trials)))
+
+    _, seed = min(depths)
+    min_circ = transpile(
+        circ, backend=backend, routing_method="sabre", seed_transpiler=seed
+    )
 
-    device_backend = FakeToronto()
-    noisy_backend = AerSimulator.from_backend(device_backend, method="density_matrix")
+    if cache_path is not None:
+        atomic_write(cache_path, lambda f: qpy.dump(min_circ, f), mode="wb")
 
-    if args.use_gpu:
-        try:
-            noisy_backend.set_options(device="GPU")
-        except AerError as e:
-            print(e)
+    return min_circ
 
-    # create 1-layer qaoa circuits
-    theta_names = [f"theta_{i}" for i in range(2)]
-    thetas = [Parameter(theta_name) for theta_name in theta_names]
-    circ = create_qaoa_circ(thetas, graph)
-    circ = transpile_circuit(circ, noisy_backend)
 
-    circ_red_qaoa = create_qaoa_circ(thetas, red_graph)
-    circ_red_qaoa = transpile_circuit(circ_red_qaoa, noisy_backend)
+def main():
+    # parse arguments
+    args = get_args()
 
-    ideal_landscape = grid_search(
-        circ, ideal_backend, graph, thetas, args.shots, args.width, "Ideal Landscape"
+    # Everything that changes the simulated circuits or the grid
+    settings = {
+        "n": args.n,
+        "width": args.width,
+        "shots": args.shots,
+        "edge_coloring": args.edge_coloring,
+        "trials": args.trials,
+    }
+    state = None
+    if args.checkpoint is not None:
+        state = load_checkpoint(args.checkpoint, settings)
+
+    # create testing and red-qaoa graph, or restore them when resuming
+    if state is not None and "graph" in state:
+        graph = nx.Graph()
+        graph.add_nodes_from(range(args.n))
+        graph.add_edges_from(state["graph"])
+        red_graph = nx.Graph()
+        red_graph.add_nodes_from(range(state["red_nodes"]))
+        red_graph.add_edges_from(state["red_graph"])
+    else:
+        graph = nx.gnp_random_graph(args.n, 0.5)
+        red_graph = red_qaoa_exe(graph)
+
+        if state is not None:
+            state["graph"] = [list(edge) for edge in graph.edges()]
+            state["red_graph"] = [list(edge) for edge in red_graph.edges()]
+            state["red_nodes"] = red_graph.number_of_nodes()
+            save_checkpoint(args.checkpoint, state)
+
+    # create the noisy circuit simulator, workers build their own copies
+    noisy_backend = get_backend("noisy", args.use_gpu)
+
+    # seeded SABRE trials run on the workers and the winner is cached on disk
+    transpile_options = {"trials": args.trials, "workers": args.workers}
+    if args.no_cache:
+        transpile_options["cache_dir"] = None
+
+    # create 1-layer qaoa circuits
+    circ, thetas = qaoa_template(
+        graph,
+        1,
+        backend=noisy_backend,
+        transpiler=transpile_circuit,
+        color_edges=args.edge_coloring,
+        **transpile_options,
+    )
+    circ_red_qaoa, thetas_red_qaoa = qaoa_template(
+        red_graph,
+        1,
+        backend=noisy_backend,
+        transpiler=transpile_circuit,
+        color_edges=args.edge_coloring,
+        **transpile_options,
     )
 
+    if args.edge_coloring:
+        for name, g in [("Baseline", graph), ("Red-QAOA", red_graph)]:
+            plain_depth = qaoa_template(g, 1)[0].depth()
+            colored_depth = qaoa_template(g, 1, color_edges=True)[0].depth()
+            print(f"{name} depth: {plain_depth} -> {colored_depth} with edge coloring")
+
+    print("Transpiled depth:", circ.depth())
+    print("Transpiled depth red:", circ_red_qaoa.depth())
+
+    if args.analytic_ideal:
+        ideal_landscape = analytic_grid(graph, args.width)
+    else:
+        ideal_landscape = grid_search(
+            circ,
+            "ideal",
+            graph,
+            thetas,
+            args.shots,
+            args.width,
+            "Ideal Landscape",
+            args.workers,
+            args.use_gpu,
+            state,
+            args.checkpoint,
+        )
+
     noisy_landscape = grid_search(
-        circ, noisy_backend, graph, thetas, args.shots, args.width, "Noisy Landscape"
+        circ,
+        "noisy",
+        graph,
+        thetas,
+        args.shots,
+        args.width,
+        "Noisy Landscape",
+        args.workers,
+        args.use_gpu,
+        state,
+        args.checkpoint,
     )
 
     red_qaoa_landscape = grid_search(
         circ_red_qaoa,
-        noisy_backend,
+        "noisy",
         red_graph,
-        thetas,
+        thetas_red_qaoa,
         args.shots,
         args.width,
         "Red-QAOA Landscape",
+        args.workers,
+        args.use_gpu,
+        state,
+        args.checkpoint,
     )
 
     ideal_landscape /= ideal_landscape.min()
@@ -0,0 +1,95 @@
+import json
+import os
+
+import numpy as np
+
+from graph_util import graph_hash, graph_invariants
+from io_util import atomic_write
+
+
+class AngleDatabase:
+    """
+    Persistent store of the best QAOA angles found per graph and depth
+
+    Entries are keyed by a content hash of the graph and the number of
+    layers p, and keep the graph invariants next to the angles, so that
+    initial points for an unseen graph can be taken from the stored graphs
+    with the most similar invariants. The oldest entries are dropped once
+    more than max_entries are stored.
+
+    Args:
+        path: str
+              JSON file holding the database, created on first write
+
+        max_entries: int
+                     maximum number of stored entries
+
+        enabled: bool
+                 bypass the database entirely when False, also disabled by
+                 setting the RED_QAOA_NO_CACHE environment variable
+    """
+
+    def __init__(self, path=".red_qaoa_angles.json", max_entries=4096, enabled=True):
+        self.path = path
+        self.max_entries = max_entries
+        self.enabled = enabled and not os.environ.get("RED_QAOA_NO_CACHE")
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return []
+
+    def lookup(self, graph, p, k=1):
+        """
+        Returns the angles of the k stored graphs nearest to graph, closest
+        first, comparing invariants scaled by their spread in the database
+        """
+        if not self.enabled:
+            return []
+
+        entries = [entry for entry in self._load() if entry["p"] == p]
+        if not entries:
+            return []
+
+        features = np.array([entry["features"] for entry in entries], dtype=np.float64)
+        scale = features.std(axis=0)
+        scale[scale == 0] = 1
+
+        query = np.array(graph_invariants(graph), dtype=np.float64)
+        distances = np.linalg.norm((features - query) / scale, axis=1)
+
+        order = np.argsort(distances, kind="stable")[:k]
+        return [np.array(entries[i]["angles"]) for i in order]
+
+    def put(self, graph, p, angles, value):
+        """
+        Stores angles reaching the expectation value on graph, unless better
+        angles for the same graph and p are already stored
+        """
+        if not self.enabled:
+            return
+
+        key = graph_hash(graph)
+        entries = self._load()
+
+        for i, entry in enumerate(entries):
+            if entry["hash"] == key and entry["p"] == p:
+                if entry["value"] <= value:
+                    return
+                del entries[i]
+                break
+
+        entries.append(
+            {
+                "hash": key,
+                "p": p,
+                "features": graph_invariants(graph),
+                "angles": [float(angle) for angle in angles],
+                "value": float(value),
+            }
+        )
+        entries = entries[-self.max_entries :]
+
+        atomic_write(self.path, lambda f: json.dump(entries, f))
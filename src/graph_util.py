@@ -0,0 +1,34 @@
+import hashlib
+import json
+
+import networkx as nx
+
+
+# Canonical node and edge lists of a graph, independent of insertion order
+def canonical_edges(graph):
+    nodes = sorted(graph.nodes, key=repr)
+    edges = sorted(
+        (tuple(sorted(edge, key=repr)) for edge in graph.edges()), key=repr
+    )
+    return nodes, edges
+
+
+# Content hash of a graph's labeled nodes and edges
+def graph_hash(graph):
+    nodes, edges = canonical_edges(graph)
+    payload = json.dumps([[repr(n) for n in nodes], [[repr(u), repr(v)] for u, v in edges]])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+# Isomorphism-invariant features of a graph, used to compare graphs
+def graph_invariants(graph):
+    degrees = [degree for _, degree in graph.degree()] or [0]
+    mean_degree = sum(degrees) / len(degrees)
+    degree_std = (sum((d - mean_degree) ** 2 for d in degrees) / len(degrees)) ** 0.5
+    return [
+        graph.number_of_nodes(),
+        mean_degree,
+        degree_std,
+        max(degrees),
+        nx.average_clustering(graph) if graph.number_of_nodes() else 0.0,
+    ]
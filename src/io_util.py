@@ -0,0 +1,30 @@
+import os
+import tempfile
+
+
+def atomic_write(path, write, mode="w"):
+    """
+    Writes a file atomically, so that concurrent readers and interrupted
+    runs never see a partial file
+
+    Args:
+        path: str
+              destination file, its directory is created if missing
+
+        write: callable
+               called with the open temporary file to write the content
+
+        mode: str
+              "w" for text or "wb" for binary content
+    """
+
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
@@ -1,4 +1,10 @@
-from qiskit import QuantumCircuit
+from collections import Counter, OrderedDict
+from functools import lru_cache
+
+import networkx as nx
+import numpy as np
+from qiskit import QuantumCircuit, transpile
+from tqdm import tqdm
 from qiskit.circuit import Parameter
 
 
@@ -26,6 +32,97 @@ def maxcut_obj(x, G):
     return obj
 
 
+def edge_index(G):
+    """
+    Endpoint arrays of the edges of a graph
+
+    Args:
+        G: networkx graph with nodes 0, 1, ..., n-1
+
+    Returns:
+        rows: np.ndarray
+              first endpoint of every edge
+
+        cols: np.ndarray
+              second endpoint of every edge
+    """
+    edges = np.array(list(G.edges()), dtype=np.int64).reshape(-1, 2)
+    return edges[:, 0], edges[:, 1]
+
+
+def counts_to_bits(counts):
+    """
+    Converts measurement results into a bit matrix
+
+    Args:
+        counts: dict
+                key as bitstring, val as count
+
+    Returns:
+        bits: np.ndarray
+              one row per bitstring, column i holds qubit i
+
+        weights: np.ndarray
+                 count of every row
+    """
+    keys = [bitstring.replace(" ", "") for bitstring in counts]
+    bits = np.frombuffer("".join(keys).encode(), dtype=np.uint8).reshape(len(keys), -1)
+    weights = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+
+    # Qiskit bitstrings are little-endian, qubit 0 is the last character
+    return bits[:, ::-1] - ord("0"), weights
+
+
+# Largest graph whose cost diagonal compute_expectation builds and caches
+DIAGONAL_MAX_QUBITS = 20
+
+
+@lru_cache(maxsize=16)
+def _maxcut_diagonal(num_nodes, edges):
+    num_edges = len(edges)
+    dtype = np.int8 if num_edges < 2**7 else np.int16 if num_edges < 2**15 else np.int32
+    diagonal = np.zeros(2**num_nodes, dtype=dtype)
+
+    # Fill in chunks to bound the size of the temporaries
+    chunk = 2**20
+    for start in range(0, 2**num_nodes, chunk):
+        z = np.arange(start, min(start + chunk, 2**num_nodes), dtype=np.uint32)
+        part = diagonal[start : start + len(z)]
+        for i, j in edges:
+            part -= (((z >> i) ^ (z >> j)) & 1).astype(dtype)
+
+    diagonal.flags.writeable = False
+    return diagonal
+
+
+def maxcut_diagonal(G, max_qubits=26):
+    """
+    Objective of every bitstring, as the diagonal of the cost Hamiltonian
+
+    The diagonal is cached per graph structure, so repeated calls for the
+    same graph are a dictionary lookup.
+
+    Args:
+        G: networkx graph with nodes 0, 1, ..., n-1
+
+        max_qubits: int
+                    refuse graphs whose diagonal would be larger
+
+    Returns:
+        diagonal: np.ndarray
+                  read-only int8/int16 array of length 2^n, entry z holds
+                  maxcut_obj of the bitstring with qubit i as bit i of z
+    """
+    num_nodes = G.number_of_nodes()
+    if num_nodes > max_qubits:
+        raise ValueError(
+            f"Cost diagonal of {num_nodes} qubits exceeds max_qubits={max_qubits}"
+        )
+
+    edges = tuple(sorted(tuple(sorted(edge)) for edge in G.edges()))
+    return _maxcut_diagonal(num_nodes, edges)
+
+
 def compute_expectation(counts, G):
     """
     Computes expectation value based on measurement results
@@ -41,22 +138,768 @@ def compute_expectation(counts, G):
              expectation value
     """
 
-    avg = 0
-    sum_count = 0
-    for bitstring, count in counts.items():
+    bits, weights = counts_to_bits(counts)
+
+    if bits.shape[1] <= DIAGONAL_MAX_QUBITS:
+        # Look the objectives up in the cached cost diagonal
+        values = bits.astype(np.int64) @ (1 << np.arange(bits.shape[1], dtype=np.int64))
+        objs = maxcut_diagonal(G)[values]
+    else:
+        rows, cols = edge_index(G)
+        objs = -np.count_nonzero(bits[:, rows] != bits[:, cols], axis=1)
+
+    return np.dot(objs, weights) / weights.sum()
+
+
+def compute_expectation_int(counts, G):
+    """
+    Computes expectation value based on integer-keyed measurement results,
+    such as the hex counts in Aer's result.data()["counts"]
+
+    Args:
+        counts: dict
+                key as int or hex string, val as count
+
+        G: networkx graph
+
+    Returns:
+        avg: float
+             expectation value
+    """
+
+    objs, weights = _int_objectives(counts, G)
+
+    return np.dot(objs, weights) / weights.sum()
+
+
+def _int_objectives(counts, G):
+    keys = [int(k, 16) if isinstance(k, str) else k for k in counts]
+    weights = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+    rows, cols = edge_index(G)
+
+    if G.number_of_nodes() <= DIAGONAL_MAX_QUBITS:
+        objs = maxcut_diagonal(G)[np.array(keys, dtype=np.int64)]
+    elif G.number_of_nodes() > 64:
+        # Too wide for machine integers, fall back to the bit matrix
+        width = G.number_of_nodes()
+        bits, weights = counts_to_bits(
+            {format(k, f"0{width}b"): v for k, v in zip(keys, weights)}
+        )
+        objs = -np.count_nonzero(bits[:, rows] != bits[:, cols], axis=1)
+    else:
+        values = np.array(keys, dtype=np.uint64)[:, None]
+        rows = rows.astype(np.uint64)
+        cols = cols.astype(np.uint64)
+        cuts = ((values >> rows) ^ (values >> cols)) & np.uint64(1)
+        objs = -cuts.sum(axis=1).astype(np.int64)
+
+    return objs, weights
+
+
+def evaluate_landscape(
+    circ, backend, G, thetas, theta_vals, shots, chunk_size=256, desc=None
+):
+    """
+    Computes expectation values of a parameterized circuit at many points
+
+    Instead of binding and running the circuit once per point, every chunk
+    of points is submitted as a single backend call with parameter_binds.
+
+    Args:
+        circ: qiskit circuit
+              parameterized circuit with measurements
+
+        backend: Aer backend
+
+        G: networkx graph
+
+        thetas: list
+                circuit parameters
+
+        theta_vals: np.ndarray
+                    one row of parameter values per point
+
+        shots: int
+               number of shots per point
+
+        chunk_size: int
+                    maximum number of points per backend call
+
+        desc: str
+              show a progress bar with this description
+
+    Returns:
+        exps: np.ndarray
+              expectation value of every point
+    """
+
+    theta_vals = np.asarray(theta_vals, dtype=np.float64).reshape(-1, len(thetas))
+    exps = np.empty(len(theta_vals))
+
+    starts = range(0, len(theta_vals), chunk_size)
+    if desc is not None:
+        starts = tqdm(starts, desc=desc)
+
+    for start in starts:
+        chunk = theta_vals[start : start + chunk_size]
+        binds = [{theta: chunk[:, k].tolist() for k, theta in enumerate(thetas)}]
+
+        result = backend.run(circ, parameter_binds=binds, shots=shots).result()
+
+        for i in range(len(chunk)):
+            exps[start + i] = compute_expectation_int(result.data(i)["counts"], G)
+
+    return exps
+
+
+def evaluate_landscape_adaptive(
+    circ,
+    backend,
+    G,
+    thetas,
+    theta_vals,
+    target_sem,
+    max_shots=8192,
+    min_shots=256,
+    chunk_size=256,
+    desc=None,
+):
+    """
+    Computes expectation values at many points with adaptive shot counts
+
+    Every point starts with min_shots and the total is doubled for the
+    points whose standard error of the cut value is still above target_sem,
+    until it is reached or max_shots have been used.
+
+    Args:
+        circ: qiskit circuit
+              parameterized circuit with measurements
+
+        backend: Aer backend
+
+        G: networkx graph
+
+        thetas: list
+                circuit parameters
+
+        theta_vals: np.ndarray
+                    one row of parameter values per point
+
+        target_sem: float
+                    standard error of the expectation value to stop at
+
+        max_shots: int
+                   maximum number of shots per point
+
+        min_shots: int
+                   number of shots of the first round
+
+        chunk_size: int
+                    maximum number of points per backend call
+
+        desc: str
+              show a progress bar with this description
+
+    Returns:
+        exps: np.ndarray
+              expectation value of every point
+
+        shots: np.ndarray
+               number of shots used for every point
+    """
+
+    theta_vals = np.asarray(theta_vals, dtype=np.float64).reshape(-1, len(thetas))
+    totals = np.zeros(len(theta_vals))
+    squares = np.zeros(len(theta_vals))
+    shots = np.zeros(len(theta_vals), dtype=np.int64)
+
+    progress = tqdm(total=len(theta_vals), desc=desc) if desc is not None else None
+
+    # The active points always share the same number of shots
+    active = np.arange(len(theta_vals))
+    batch = min(min_shots, max_shots)
+    while len(active) > 0:
+        for start in range(0, len(active), chunk_size):
+            points = active[start : start + chunk_size]
+            chunk = theta_vals[points]
+            binds = [{theta: chunk[:, k].tolist() for k, theta in enumerate(thetas)}]
+
+            result = backend.run(circ, parameter_binds=binds, shots=batch).result()
+
+            for i, point in enumerate(points):
+                objs, weights = _int_objectives(result.data(i)["counts"], G)
+                totals[point] += np.dot(objs, weights)
+                squares[point] += np.dot(objs.astype(np.float64) ** 2, weights)
+
+        shots[active] += batch
+        used = shots[active[0]]
+
+        mean = totals[active] / used
+        variance = np.maximum(squares[active] / used - mean**2, 0)
+        sem = np.sqrt(variance / max(used - 1, 1))
+
+        done = (sem <= target_sem) | (used >= max_shots)
+        if progress is not None:
+            progress.update(np.count_nonzero(done))
+
+        active = active[~done]
+        batch = min(used, max_shots - used)
+
+    if progress is not None:
+        progress.close()
+
+    return totals / shots, shots
+
+
+def qaoa_statevector(theta, G, symmetric=False):
+    """
+    Simulates the circuit of create_qaoa_circ with NumPy, without measurement
+
+    The cost layer is applied as an elementwise phase from the cost diagonal
+    and the mixer as 2x2 rotations on a reshaped view of the state.
+
+    Args:
+        theta: list
+               unitary parameters, betas followed by gammas
+
+        G: networkx graph with nodes 0, 1, ..., n-1
+
+        symmetric: bool
+                   use the global bit flip symmetry of the QAOA state and
+                   only simulate the half where the last qubit is 0
+
+    Returns:
+        state: np.ndarray
+               complex statevector, qubit i is bit i of the index; with
+               symmetric, only the first half, holding a norm of 1/2
+    """
+
+    nqubits = len(G.nodes())
+    p = len(theta) // 2  # number of alternating unitaries
+
+    beta = theta[:p]
+    gamma = theta[p:]
+
+    size = 2 ** (nqubits - 1) if symmetric else 2**nqubits
+    diagonal = maxcut_diagonal(G)[:size]
+
+    # initial_state
+    state = np.full(size, 2 ** (-nqubits / 2), dtype=np.complex128)
+
+    for irep in range(0, p):
+        # problem unitary, rzz(2 * gamma) on every edge up to a global phase
+        state *= np.exp(-2j * gamma[irep] * diagonal)
+
+        # mixer unitary, rx(beta) on every qubit
+        _apply_mixer(state, beta[irep], nqubits, symmetric)
+
+    return state
+
+
+def _apply_mixer(state, beta, nqubits, symmetric=False):
+    cos = np.cos(beta / 2)
+    isin = -1j * np.sin(beta / 2)
+    for i in range(0, nqubits):
+        if symmetric and i == nqubits - 1:
+            # The missing half is the stored half with all bits flipped,
+            # which reverses the index order
+            flipped = state[::-1].copy()
+            state *= cos
+            state += isin * flipped
+            continue
+
+        view = state.reshape(-1, 2, 2**i)
+        zero = view[:, 0, :].copy()
+        one = view[:, 1, :]
+        view[:, 0, :] = cos * zero + isin * one
+        view[:, 1, :] = isin * zero + cos * one
+
+
+# Sum of X on every qubit applied to a statevector
+def _sum_x(state, nqubits):
+    out = np.zeros_like(state)
+    for i in range(0, nqubits):
+        view = state.reshape(-1, 2, 2**i)
+        out_view = out.reshape(-1, 2, 2**i)
+        out_view[:, 0, :] += view[:, 1, :]
+        out_view[:, 1, :] += view[:, 0, :]
+    return out
+
+
+def qaoa_expectation(theta, G, symmetric=False):
+    """
+    Exact expectation value of the QAOA circuit, without shot noise
+
+    Args:
+        theta: list
+               unitary parameters
+
+        G: networkx graph
+
+        symmetric: bool
+                   simulate half the state using the global bit flip symmetry
+
+    Returns:
+        avg: float
+             expectation value
+    """
+    state = qaoa_statevector(theta, G, symmetric)
+    probs = np.abs(state) ** 2
+    if symmetric:
+        probs *= 2
+    return np.dot(probs, maxcut_diagonal(G)[: len(probs)])
+
 
-        obj = maxcut_obj(bitstring[::-1], G)
-        avg += obj * count
-        sum_count += count
+def qaoa_gradient(theta, G, observable=None):
+    """
+    Exact expectation value and its gradient by adjoint differentiation
+
+    The state is simulated once, then the state and the observable applied
+    to it are both run back through the circuit, picking up the derivative
+    of every layer on the way. This costs about three simulations however
+    many parameters there are.
+
+    Args:
+        theta: list
+               unitary parameters, betas followed by gammas
 
-    return avg/sum_count
+        G: networkx graph with nodes 0, 1, ..., n-1
+
+        observable: np.ndarray
+                    diagonal of the measured observable, defaults to the
+                    MaxCut cost diagonal
+
+    Returns:
+        avg: float
+             expectation value
+
+        grad: np.ndarray
+              gradient with respect to theta
+    """
+
+    nqubits = len(G.nodes())
+    p = len(theta) // 2  # number of alternating unitaries
+
+    beta = theta[:p]
+    gamma = theta[p:]
+
+    diagonal = maxcut_diagonal(G)
+    if observable is None:
+        observable = diagonal
+
+    state = qaoa_statevector(theta, G)
+    costate = observable * state
+    avg = np.real(np.vdot(state, costate))
+
+    grad = np.empty(2 * p)
+    for irep in reversed(range(0, p)):
+        # mixer unitary, d/dbeta exp(-i beta X / 2) = -i X / 2 exp(-i beta X / 2)
+        grad[irep] = np.real(np.vdot(costate, -1j * _sum_x(state, nqubits)))
+        _apply_mixer(state, -beta[irep], nqubits)
+        _apply_mixer(costate, -beta[irep], nqubits)
+
+        # problem unitary, d/dgamma exp(-2i gamma C) = -2i C exp(-2i gamma C)
+        grad[p + irep] = np.real(np.vdot(costate, -4j * diagonal * state))
+        phase = np.exp(2j * gamma[irep] * diagonal)
+        state *= phase
+        costate *= phase
+
+    return avg, grad
+
+
+def get_parameter_shift_gradient(G, p, backend, shots, chunk_size=256):
+    """
+    Returns a function computing the sampled expectation value and its
+    gradient with the parameter-shift rule
+
+    Every rzz and rx gate gets its own parameter, so the shift rule applies
+    gate by gate. The unshifted point and both shifts of every gate are
+    submitted together through evaluate_landscape, which takes
+    1 + 2 * p * (n + m) circuit executions per gradient.
+
+    Args:
+        G: networkx graph
+
+        p: int
+           number of alternating unitaries
+
+        backend: Aer backend
+
+        shots: int
+               number of shots per circuit execution
+
+        chunk_size: int
+                    maximum number of circuits per backend call
+
+    Returns:
+        execute_shifts: function
+                        maps theta to the expectation value and gradient
+    """
+
+    nqubits = len(G.nodes())
+    edges = list(G.edges())
+
+    gamma_params = [
+        [Parameter(f"gamma_{irep}_{k}") for k in range(len(edges))]
+        for irep in range(p)
+    ]
+    beta_params = [
+        [Parameter(f"beta_{irep}_{i}") for i in range(nqubits)] for irep in range(p)
+    ]
+
+    qc = QuantumCircuit(nqubits)
+    for i in range(0, nqubits):
+        qc.h(i)
+    for irep in range(0, p):
+        for (u, v), param in zip(edges, gamma_params[irep]):
+            qc.rzz(param, u, v)
+        for i, param in enumerate(beta_params[irep]):
+            qc.rx(param, i)
+    qc.measure_all()
+
+    # Parameters of each layer, rzz angles first, then rx angles
+    parameters = [
+        param for irep in range(p) for param in gamma_params[irep] + beta_params[irep]
+    ]
+    width = len(edges) + nqubits
+
+    def execute_shifts(theta):
+        theta = np.asarray(theta, dtype=np.float64)
+        beta = theta[:p]
+        gamma = theta[p:]
+
+        base = np.concatenate(
+            [
+                np.concatenate(
+                    [np.full(len(edges), 2 * gamma[irep]), np.full(nqubits, beta[irep])]
+                )
+                for irep in range(p)
+            ]
+        )
+        shifts = np.eye(len(base)) * np.pi / 2
+        rows = np.vstack([base, base + shifts, base - shifts])
+
+        exps = evaluate_landscape(qc, backend, G, parameters, rows, shots, chunk_size)
+        diffs = ((exps[1 : len(base) + 1] - exps[len(base) + 1 :]) / 2).reshape(p, width)
+
+        # rzz angles are 2 * gamma, rx angles are beta
+        grad = np.concatenate(
+            [diffs[:, len(edges) :].sum(axis=1), 2 * diffs[:, : len(edges)].sum(axis=1)]
+        )
+        return exps[0], grad
+
+    return execute_shifts
+
+
+def lightcone(G, edge, p):
+    """
+    Subgraph that determines <Z_u Z_v> of an edge after p QAOA layers
+
+    Only nodes within distance p of the edge and edges with an endpoint
+    within distance p - 1 influence the term, the rest of the circuit
+    cancels out.
+
+    Args:
+        G: networkx graph
+
+        edge: tuple
+              the edge (u, v)
+
+        p: int
+           number of alternating unitaries
+
+    Returns:
+        cone: networkx graph
+              light cone relabeled to 0, 1, 2, ..., with u as 0 and v as 1
+    """
+
+    u, v = edge
+    dist_u = nx.single_source_shortest_path_length(G, u, cutoff=p)
+    dist_v = nx.single_source_shortest_path_length(G, v, cutoff=p)
+    dist = {x: min(dist_u.get(x, p), dist_v.get(x, p)) for x in {**dist_u, **dist_v}}
+
+    others = sorted(
+        (x for x in dist if x not in (u, v)), key=lambda x: (dist[x], repr(x))
+    )
+    mapping = {x: i for i, x in enumerate([u, v] + others)}
+
+    cone = nx.Graph()
+    cone.add_nodes_from(range(len(mapping)))
+    cone.add_edges_from(
+        (mapping[a], mapping[b])
+        for a, b in G.subgraph(mapping).edges()
+        if min(dist[a], dist[b]) < p
+    )
+    for x in cone.nodes:
+        cone.nodes[x]["root"] = x < 2
+
+    return cone
+
+
+def get_lightcone_expectation(G, p, max_qubits=20, symmetric=False, gradient=False):
+    """
+    Exact expectation value from per-edge light cones
+
+    Every edge term is simulated on its light cone only, and isomorphic
+    light cones are simulated once. This reaches graphs far beyond full
+    statevector simulation when p is low and the graph is sparse.
+
+    Args:
+        G: networkx graph
+
+        p: int
+           number of alternating unitaries
+
+        max_qubits: int
+                    refuse graphs with larger light cones
+
+        symmetric: bool
+                   simulate half of every cone state using the global bit
+                   flip symmetry; isomorphic cones are already merged
+
+        gradient: bool
+                  also return the gradient, by adjoint differentiation of
+                  every cone; symmetric is then ignored
+
+    Returns:
+        execute_cones: callable
+                       maps unitary parameters to the expectation value,
+                       or to the expectation value and gradient
+    """
+
+    # Group isomorphic light cones, hashing first and confirming with VF2
+    groups = {}
+    for edge in G.edges():
+        cone = lightcone(G, edge, p)
+        if cone.number_of_nodes() > max_qubits:
+            raise ValueError(
+                f"Light cone of {cone.number_of_nodes()} qubits exceeds "
+                f"max_qubits={max_qubits}"
+            )
+
+        key = nx.weisfeiler_lehman_graph_hash(cone, node_attr="root")
+        for entry in groups.setdefault(key, []):
+            if nx.is_isomorphic(
+                entry[0], cone, node_match=lambda a, b: a["root"] == b["root"]
+            ):
+                entry[1] += 1
+                break
+        else:
+            groups[key].append([cone, 1])
+
+    cones = [entry for entries in groups.values() for entry in entries]
+
+    # Whether the root edge (0, 1) is cut, for every basis state of a cone
+    if gradient:
+        symmetric = False
+    cut_masks = []
+    for cone, _ in cones:
+        z = np.arange(2 ** (cone.number_of_nodes() - symmetric))
+        cut_masks.append(((z ^ (z >> 1)) & 1).astype(np.float64))
+
+    def execute_cones(theta):
+        if gradient:
+            avg = 0
+            grad = np.zeros(len(theta))
+            for (cone, count), mask in zip(cones, cut_masks):
+                value, cone_grad = qaoa_gradient(
+                    np.asarray(theta, dtype=np.float64), cone, mask
+                )
+                avg -= count * value
+                grad -= count * cone_grad
+
+            return avg, grad
+
+        avg = 0
+        for (cone, count), mask in zip(cones, cut_masks):
+            probs = np.abs(qaoa_statevector(theta, cone, symmetric)) ** 2
+            if symmetric:
+                probs *= 2
+            avg -= count * np.dot(probs, mask)
+
+        return avg
+
+    return execute_cones
+
+
+def qaoa_sample_counts(theta, G, shots, seed=None):
+    """
+    Samples measurement results from the simulated QAOA circuit
+
+    Args:
+        theta: list
+               unitary parameters
+
+        G: networkx graph
+
+        shots: int
+               number of samples
+
+        seed: int
+              seed for the sampler
+
+    Returns:
+        counts: dict
+                key as bitstring, val as count, in Qiskit's format
+    """
+    nqubits = len(G.nodes())
+    probs = np.abs(qaoa_statevector(theta, G)) ** 2
+    samples = np.random.default_rng(seed).multinomial(shots, probs / probs.sum())
+
+    return {
+        format(z, f"0{nqubits}b"): int(samples[z]) for z in np.flatnonzero(samples)
+    }
+
+
+def p1_expectation(beta, gamma, G):
+    """
+    Closed-form expectation value of the p=1 QAOA circuit
+
+    Every edge (u, v) contributes a term that only depends on the degrees of
+    u and v and on the number of triangles through the edge (Wang et al.,
+    PRA 97, 022304), so edges with equal statistics are evaluated once.
+    beta and gamma broadcast against each other, so a whole landscape grid
+    is evaluated in one call.
+
+    Args:
+        beta: float or np.ndarray
+              mixer parameter, as bound to theta[0] of create_qaoa_circ
+
+        gamma: float or np.ndarray
+               problem parameter, as bound to theta[1] of create_qaoa_circ
+
+        G: networkx graph
+
+    Returns:
+        avg: float or np.ndarray
+             expectation value for every (beta, gamma) pair
+    """
+
+    # Group edges by (degree(u) - 1, degree(v) - 1, shared neighbours)
+    terms = Counter()
+    for u, v in G.edges():
+        du, dv = sorted((G.degree(u) - 1, G.degree(v) - 1))
+        triangles = len(set(G[u]) & set(G[v]))
+        terms[(du, dv, triangles)] += 1
+
+    # rx(beta) is exp(-i beta/2 X) and rzz(2 gamma) is exp(i gamma (1 - ZZ)) up to
+    # a global phase, so the formula's angles are beta/2 and -2 gamma
+    b = np.asarray(beta, dtype=np.float64) / 2
+    g = -2 * np.asarray(gamma, dtype=np.float64)
+
+    cos_g = np.cos(g)
+    cos_2g = np.cos(2 * g)
+    sin_4b = np.sin(4 * b)
+    sin_2b_sq = np.sin(2 * b) ** 2
+    sin_g = np.sin(g)
+
+    cut = 0
+    for (du, dv, triangles), count in terms.items():
+        edge = (
+            0.5
+            + 0.25 * sin_4b * sin_g * (cos_g**du + cos_g**dv)
+            - 0.25
+            * sin_2b_sq
+            * cos_g ** (du + dv - 2 * triangles)
+            * (1 - cos_2g**triangles)
+        )
+        cut = cut + count * edge
+
+    return -cut
+
+
+def edge_coloring(G):
+    """
+    Proper edge coloring with at most max degree + 1 colors (Misra & Gries)
+
+    Args:
+        G: networkx graph
+
+    Returns:
+        classes: list
+                 one list of edges per color, no two edges of a class share
+                 a node, so every class is a single layer of parallel gates
+    """
+
+    max_degree = max((d for _, d in G.degree()), default=0)
+    palette = range(max_degree + 1)
+
+    # at[x][c] is the node joined to x by the edge with color c
+    at = {x: {} for x in G.nodes}
+    color = {}
+
+    def set_color(x, y, c):
+        old = color.pop(frozenset((x, y)), None)
+        if old is not None:
+            del at[x][old]
+            del at[y][old]
+        if c is not None:
+            color[frozenset((x, y))] = c
+            at[x][c] = y
+            at[y][c] = x
+
+    def free_color(x):
+        return next(c for c in palette if c not in at[x])
+
+    def is_fan(u, fan):
+        return all(
+            frozenset((u, fan[i])) in color and color[frozenset((u, fan[i]))] not in at[fan[i - 1]]
+            for i in range(1, len(fan))
+        )
+
+    for u, v in G.edges():
+        if u == v:
+            raise ValueError("Edge coloring is undefined for self loops")
+
+        # Maximal fan of u starting at the uncolored edge (u, v)
+        fan = [v]
+        extended = True
+        while extended:
+            extended = False
+            for c, x in at[u].items():
+                if x not in fan and c not in at[fan[-1]]:
+                    fan.append(x)
+                    extended = True
+                    break
+
+        c = free_color(u)
+        d = free_color(fan[-1])
+
+        # Invert the path from u whose edges alternate between colors d and c
+        path = []
+        x, next_color = u, d
+        while next_color in at[x]:
+            y = at[x][next_color]
+            path.append((x, y, next_color))
+            x, next_color = y, c if next_color == d else d
+        for x, y, _ in path:
+            set_color(x, y, None)
+        for x, y, old in path:
+            set_color(x, y, c if old == d else d)
+
+        # Rotate the shortest prefix of the fan that ends where d is free
+        w = next(
+            i for i in range(len(fan)) if d not in at[fan[i]] and is_fan(u, fan[: i + 1])
+        )
+        shifted = [color[frozenset((u, fan[i + 1]))] for i in range(w)]
+        for i in range(1, w + 1):
+            set_color(u, fan[i], None)
+        for i in range(w):
+            set_color(u, fan[i], shifted[i])
+        set_color(u, fan[w], d)
+
+    classes = [[] for _ in palette]
+    for u, v in G.edges():
+        classes[color[frozenset((u, v))]].append((u, v))
+
+    return [edges for edges in classes if edges]
 
 
 # We will also bring the different circuit components that
 # build the qaoa circuit under a single function
 
 
-def create_qaoa_circ(theta, G):
+def create_qaoa_circ(theta, G, color_edges=False):
     """
     Creates a parametrized qaoa circuit
 
@@ -64,6 +907,9 @@ def create_qaoa_circ(theta, G):
         G: networkx graph
         theta: list
                unitary parameters
+        color_edges: bool
+                     order the problem unitary by an edge coloring, so that
+                     it takes at most max degree + 1 layers
 
     Returns:
         qc: qiskit circuit
@@ -80,10 +926,15 @@ def create_qaoa_circ(theta, G):
     for i in range(0, nqubits):
         qc.h(i)
 
+    if color_edges:
+        pairs = [pair for edges in edge_coloring(G) for pair in edges]
+    else:
+        pairs = list(G.edges())
+
     for irep in range(0, p):
 
         # problem unitary
-        for pair in list(G.edges()):
+        for pair in pairs:
             qc.rzz(2 * gamma[irep], pair[0], pair[1])
 
         # mixer unitary
@@ -93,3 +944,70 @@ def create_qaoa_circ(theta, G):
     qc.measure_all()
 
     return qc
+
+
+# Maximum number of circuits kept by qaoa_template
+TEMPLATE_CACHE_SIZE = 64
+
+_templates = OrderedDict()
+
+
+def qaoa_template(
+    G, p, backend=None, transpiler=transpile, color_edges=False, **transpile_options
+):
+    """
+    Returns a cached parameterized qaoa circuit
+
+    Templates are keyed by the graph structure and p, and for transpiled
+    variants also by the backend, the transpiler and its options. Only the
+    TEMPLATE_CACHE_SIZE most recently used templates are kept. The returned
+    circuit is shared and must not be modified, bind its parameters instead.
+
+    Args:
+        G: networkx graph
+
+        p: int
+           number of alternating unitaries
+
+        backend: qiskit backend
+                 transpile the circuit for this backend when given
+
+        transpiler: callable
+                    called as transpiler(circuit, backend=backend, **transpile_options)
+
+        color_edges: bool
+                     order the problem unitary by an edge coloring
+
+    Returns:
+        qc: qiskit circuit
+
+        parameters: list
+                    circuit parameters, betas followed by gammas
+    """
+
+    edges = tuple(sorted(tuple(sorted(edge)) for edge in G.edges()))
+    key = (G.number_of_nodes(), edges, p, color_edges)
+    if backend is not None:
+        name = backend.name() if callable(backend.name) else backend.name
+        key += (
+            name,
+            f"{transpiler.__module__}.{transpiler.__qualname__}",
+            repr(sorted(transpile_options.items())),
+        )
+
+    if key in _templates:
+        _templates.move_to_end(key)
+        return _templates[key]
+
+    if backend is None:
+        parameters = [Parameter(f"theta_{i}") for i in range(2 * p)]
+        template = (create_qaoa_circ(parameters, G, color_edges), parameters)
+    else:
+        qc, parameters = qaoa_template(G, p, color_edges=color_edges)
+        template = (transpiler(qc, backend=backend, **transpile_options), parameters)
+
+    _templates[key] = template
+    while len(_templates) > TEMPLATE_CACHE_SIZE:
+        _templates.popitem(last=False)
+
+    return template
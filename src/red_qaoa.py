@@ -1,7 +1,12 @@
-from itertools import combinations
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import networkx as nx
+import numpy as np
+import scipy.sparse as sp
 import random
 import math
+import time
+
+from graph_util import graph_hash
 
 
 # Average node degree of a graph
@@ -34,50 +39,176 @@ def generate_neighbor(subgraph, graph):
     return neighbor
 
 
-# Simulated annealing algorithm for finding a subgraph of a given size
-# with cloest average node degree to the original graph
-def sa(
-    graph,
+# Index the nodes of a graph and build integer adjacency lists
+def _index_graph(graph):
+    nodes = list(graph.nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    adjacency = [[index[nbr] for nbr in graph.neighbors(node)] for node in nodes]
+    return nodes, adjacency
+
+
+# Build the subgraph induced by the selected node indices, relabeled to 0, 1, 2, ...
+def _induced_subgraph(graph, nodes, selected):
+    selected_nodes = [nodes[i] for i in sorted(selected)]
+    mapping = {k: v for v, k in enumerate(selected_nodes)}
+
+    subgraph = nx.Graph()
+    subgraph.add_nodes_from(range(len(selected_nodes)))
+    subgraph.add_edges_from(
+        (mapping[u], mapping[v])
+        for u in selected_nodes
+        for v in graph.adj[u]
+        if v in mapping and mapping[u] < mapping[v]
+    )
+    return subgraph
+
+
+# Selected node set of an annealing chain
+# Nodes are kept in index arrays with a membership mask and a running count of
+# induced edges, so a swap is evaluated in O(deg(u) + deg(v)) without copying graphs
+class _SubgraphState:
+    def __init__(self, adjacency, selected):
+        num_nodes = len(adjacency)
+
+        self.adjacency = adjacency
+        self.member = [False] * num_nodes
+        for i in selected:
+            self.member[i] = True
+
+        self.selected = list(selected)
+        self.unselected = [i for i in range(num_nodes) if not self.member[i]]
+
+        self.position = [0] * num_nodes
+        for pos, i in enumerate(self.selected):
+            self.position[i] = pos
+        for pos, i in enumerate(self.unselected):
+            self.position[i] = pos
+
+        self.edges = sum(self.links(i) for i in self.selected) // 2
+
+    # Number of selected neighbors of node i
+    def links(self, i, exclude=None):
+        member = self.member
+        return sum(1 for j in self.adjacency[i] if member[j] and j != exclude)
+
+    # Average node degree of the selected subgraph if it had the given edge count
+    def average_degree(self, edges=None):
+        if edges is None:
+            edges = self.edges
+        return 2 * edges / len(self.selected)
+
+    # Pick a random selected node to remove and a random unselected node to add
+    def propose(self, rng):
+        u = self.selected[rng.randrange(len(self.selected))]
+        v = self.unselected[rng.randrange(len(self.unselected))]
+        return u, v
+
+    # Change in the induced edge count when swapping u out and v in
+    def swap_delta(self, u, v):
+        return self.links(v, exclude=u) - self.links(u)
+
+    def swap(self, u, v, delta_edges):
+        pos_u = self.position[u]
+        pos_v = self.position[v]
+
+        self.selected[pos_u] = v
+        self.unselected[pos_v] = u
+        self.position[u] = pos_v
+        self.position[v] = pos_u
+        self.member[u] = False
+        self.member[v] = True
+        self.edges += delta_edges
+
+
+# Simulated annealing over node swaps, shared by sa and sa_adapt
+# Stops early once time.perf_counter() passes deadline
+# Returns the indices of the best node set found and its objective
+def _anneal(
+    adjacency,
+    target_and,
     subgraph_size,
-    initial_temperature=100,
-    cooling_rate=0.99,
-    stopping_temperature=1e-6,
+    initial_temperature,
+    cooling_rate,
+    stopping_temperature,
+    max_rejections=None,
+    rng=random,
+    initial=None,
+    deadline=None,
 ):
-    original_graph_and = average_node_degree(graph)
+    # Initialize the subgraph with random nodes unless a warm start is given
+    if initial is None:
+        initial = rng.sample(range(len(adjacency)), subgraph_size)
+    state = _SubgraphState(adjacency, initial)
 
-    # Initialize the subgraph with random nodes
-    nodes = list(graph.nodes)
-    random.shuffle(nodes)
-    subgraph = graph.subgraph(nodes[:subgraph_size]).copy()
+    current_objective = abs(state.average_degree() - target_and)
 
     # Initialize the best subgraph found so far
-    best_subgraph = subgraph.copy()
-    best_objective = objective_function(subgraph, original_graph_and)
+    best_selected = list(state.selected)
+    best_objective = current_objective
+
+    # No swap is possible when every node is selected
+    if not state.unselected:
+        return best_selected, best_objective
 
     temperature = initial_temperature
+    rejections = 0
 
-    while temperature > stopping_temperature:
-        neighbor = generate_neighbor(subgraph, graph)
-        current_objective = objective_function(subgraph, original_graph_and)
-        neighbor_objective = objective_function(neighbor, original_graph_and)
+    while temperature > stopping_temperature and (
+        max_rejections is None or rejections < max_rejections
+    ):
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+
+        u, v = state.propose(rng)
+        delta_edges = state.swap_delta(u, v)
+        neighbor_objective = abs(
+            state.average_degree(state.edges + delta_edges) - target_and
+        )
         delta_energy = neighbor_objective - current_objective
 
-        if delta_energy < 0 or random.random() < math.exp(-delta_energy / temperature):
-            subgraph = neighbor
+        if delta_energy < 0 or rng.random() < math.exp(-delta_energy / temperature):
+            state.swap(u, v, delta_edges)
             current_objective = neighbor_objective
 
             if current_objective < best_objective:
-                best_subgraph = subgraph.copy()
+                best_selected = list(state.selected)
                 best_objective = current_objective
+                rejections = 0
+            else:
+                rejections += 1
 
         temperature *= cooling_rate
 
-    mapping = {
-        k: v
-        for k, v in zip(best_subgraph.nodes(), range(best_subgraph.number_of_nodes()))
-    }
+        if max_rejections is not None:
+            if rejections >= max_rejections / 2:
+                cooling_rate *= 0.9  # Reduce cooling rate to explore more
+            elif current_objective < best_objective:
+                cooling_rate *= 1.1  # Increase cooling rate to converge faster
 
-    return nx.relabel_nodes(best_subgraph, mapping)
+    return best_selected, best_objective
+
+
+# Simulated annealing algorithm for finding a subgraph of a given size
+# with cloest average node degree to the original graph
+def sa(
+    graph,
+    subgraph_size,
+    initial_temperature=100,
+    cooling_rate=0.99,
+    stopping_temperature=1e-6,
+):
+    nodes, adjacency = _index_graph(graph)
+
+    best_selected, _ = _anneal(
+        adjacency,
+        average_node_degree(graph),
+        subgraph_size,
+        initial_temperature,
+        cooling_rate,
+        stopping_temperature,
+    )
+
+    return _induced_subgraph(graph, nodes, best_selected)
 
 
 # Adaptive simulated annealing algorithm for finding a subgraph of a given size
@@ -90,61 +221,182 @@ def sa_adapt(
     stopping_temperature=1e-6,
     max_rejections=10,
 ):
-    original_graph_and = average_node_degree(graph)
+    nodes, adjacency = _index_graph(graph)
+
+    best_selected, _ = _anneal(
+        adjacency,
+        average_node_degree(graph),
+        subgraph_size,
+        initial_temperature,
+        cooling_rate,
+        stopping_temperature,
+        max_rejections=max_rejections,
+    )
 
-    # Initialize the subgraph with random nodes
-    nodes = list(graph.nodes)
-    random.shuffle(nodes)
-    subgraph = graph.subgraph(nodes[:subgraph_size]).copy()
+    # relabel nodes to 0, 1, 2, ...
+    return _induced_subgraph(graph, nodes, best_selected)
 
-    # Initialize the best subgraph found so far
-    best_subgraph = subgraph.copy()
-    best_objective = objective_function(subgraph, original_graph_and)
 
-    temperature = initial_temperature
-    rejections = 0
+# Vectorized simulated annealing running independent chains side by side
+# Each row of the membership matrix is one chain; swaps, edge-count deltas and
+# Metropolis acceptance are evaluated for all chains at once
+# Stops early once time.perf_counter() passes deadline
+# Returns the indices of the best node set across chains and its objective
+def _anneal_chains(
+    adjacency_matrix,
+    target_and,
+    subgraph_size,
+    num_chains,
+    initial_temperature,
+    cooling_rate,
+    stopping_temperature,
+    rng,
+    initial=None,
+    deadline=None,
+):
+    num_nodes = adjacency_matrix.shape[0]
+    chains = np.arange(num_chains)
 
-    while temperature > stopping_temperature and rejections < max_rejections:
-        neighbor = generate_neighbor(subgraph, graph)
-        current_objective = objective_function(subgraph, original_graph_and)
-        neighbor_objective = objective_function(neighbor, original_graph_and)
-        delta_energy = neighbor_objective - current_objective
+    # Initialize every chain with its own random nodes unless a warm start is given
+    order = np.argsort(rng.random((num_chains, num_nodes)), axis=1)
+    if initial is not None:
+        rank = np.ones(num_nodes)
+        rank[initial] = 0
+        first = np.argsort(rank[order], axis=1, kind="stable")
+        order = np.take_along_axis(order, first, axis=1)
+    selected = order[:, :subgraph_size].copy()
+    unselected = order[:, subgraph_size:].copy()
 
-        if delta_energy < 0 or random.random() < math.exp(-delta_energy / temperature):
-            subgraph = neighbor
-            current_objective = neighbor_objective
+    member = np.zeros((num_chains, num_nodes), dtype=np.int8)
+    member[chains[:, None], selected] = 1
 
-            if current_objective < best_objective:
-                best_subgraph = subgraph.copy()
-                best_objective = current_objective
-                rejections = 0
-            else:
-                rejections += 1
+    edges = ((member @ adjacency_matrix.astype(np.int64)) * member).sum(axis=1) // 2
+    objective = np.abs(2 * edges / subgraph_size - target_and)
+
+    # Initialize the best subgraph found so far in each chain
+    best_selected = selected.copy()
+    best_objective = objective.copy()
+
+    temperature = initial_temperature
+
+    # No swap is possible when every node is selected
+    while temperature > stopping_temperature and unselected.shape[1] > 0:
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+
+        pos_u = rng.integers(subgraph_size, size=num_chains)
+        pos_v = rng.integers(num_nodes - subgraph_size, size=num_chains)
+        u = selected[chains, pos_u]
+        v = unselected[chains, pos_v]
+
+        links_u = (adjacency_matrix[u] * member).sum(axis=1)
+        links_v = (adjacency_matrix[v] * member).sum(axis=1) - adjacency_matrix[v, u]
+        neighbor_edges = edges - links_u + links_v
+        neighbor_objective = np.abs(2 * neighbor_edges / subgraph_size - target_and)
+        delta_energy = neighbor_objective - objective
+
+        accept = (delta_energy < 0) | (
+            rng.random(num_chains)
+            < np.exp(-np.maximum(delta_energy, 0) / temperature)
+        )
+
+        rows = chains[accept]
+        member[rows, u[accept]] = 0
+        member[rows, v[accept]] = 1
+        selected[rows, pos_u[accept]] = v[accept]
+        unselected[rows, pos_v[accept]] = u[accept]
+        edges = np.where(accept, neighbor_edges, edges)
+        objective = np.where(accept, neighbor_objective, objective)
+
+        improved = objective < best_objective
+        best_selected[improved] = selected[improved]
+        best_objective[improved] = objective[improved]
 
         temperature *= cooling_rate
 
-        if rejections >= max_rejections / 2:
-            cooling_rate *= 0.9  # Reduce cooling rate to explore more
-        elif current_objective < best_objective:
-            cooling_rate *= 1.1  # Increase cooling rate to converge faster
+    best = np.argmin(best_objective)
+    return best_selected[best].tolist(), float(best_objective[best])
 
-    # relabel nodes to 0, 1, 2, ...
-    mapping = {
-        k: v
-        for k, v in zip(best_subgraph.nodes(), range(best_subgraph.number_of_nodes()))
-    }
 
-    return nx.relabel_nodes(best_subgraph, mapping)
+# Multi-chain simulated annealing algorithm for finding a subgraph of a given size
+# with cloest average node degree to the original graph
+# Runs num_chains independent chains with NumPy and keeps the best result
+def sa_multi(
+    graph,
+    subgraph_size,
+    num_chains=16,
+    initial_temperature=100,
+    cooling_rate=0.99,
+    stopping_temperature=1e-6,
+    seed=None,
+):
+    nodes = list(graph.nodes)
+    adjacency_matrix = nx.to_numpy_array(graph, nodelist=nodes, dtype=np.int8)
+
+    best_selected, _ = _anneal_chains(
+        adjacency_matrix,
+        average_node_degree(graph),
+        subgraph_size,
+        num_chains,
+        initial_temperature,
+        cooling_rate,
+        stopping_temperature,
+        np.random.default_rng(seed),
+    )
+
+    return _induced_subgraph(graph, nodes, best_selected)
+
+
+# Lazily enumerate the connected induced subgraphs of a given size
+# Uses extension-based enumeration (ESU), so every connected node set is produced
+# exactly once without visiting disconnected combinations
+# Yields sorted node tuples; and_window=(low, high) keeps only subgraphs whose
+# average node degree lies within the window
+def connected_subgraphs(graph, subgraph_size, and_window=None):
+    nodes, adjacency = _index_graph(graph)
+    neighbor_sets = [set(nbrs) for nbrs in adjacency]
+
+    if and_window is None:
+        min_edges, max_edges = 0, math.inf
+    else:
+        min_edges = and_window[0] * subgraph_size / 2
+        max_edges = and_window[1] * subgraph_size / 2
+
+    def extend(selected, neighborhood, extension, root, edges):
+        if len(selected) == subgraph_size:
+            if min_edges <= edges <= max_edges:
+                yield tuple(nodes[i] for i in sorted(selected))
+            return
+
+        extension = list(extension)
+        while extension:
+            w = extension.pop()
+            # Only nodes exclusive to w extend the set, so no set is found twice
+            exclusive = [u for u in adjacency[w] if u > root and u not in neighborhood]
+            yield from extend(
+                selected + [w],
+                neighborhood | neighbor_sets[w],
+                extension + exclusive,
+                root,
+                edges + len(neighbor_sets[w].intersection(selected)),
+            )
+
+    for root in range(len(nodes)):
+        yield from extend(
+            [root],
+            neighbor_sets[root] | {root},
+            [u for u in adjacency[root] if u > root],
+            root,
+            0,
+        )
 
 
 # Generate all possible subgraphs of a given size
 def all_possible_subgraphs(graph, subgraph_size):
-    subgraphs = []
-    for nodes_subset in combinations(graph.nodes, subgraph_size):
-        sub_g = graph.subgraph(nodes_subset).copy()
-        if nx.is_connected(sub_g):
-            subgraphs.append(sub_g)
-    return subgraphs
+    return [
+        graph.subgraph(nodes_subset).copy()
+        for nodes_subset in connected_subgraphs(graph, subgraph_size)
+    ]
 
 
 # Generate random subgraphs of a given size
@@ -157,27 +409,568 @@ def random_subgraphs(graph, subgraph_size, num_samples):
     return subgraphs
 
 
-# Red-QAOA algorithm for reducing the graph size for QAOA
-def red_qaoa_exe(graph, and_ratio=0.75):
+# Grow or shrink a node set to the given size for warm starting annealing
+# Greedily adds or removes the node that keeps the average node degree
+# closest to the target; the candidates are bucketed by their number of
+# selected neighbors, so every step looks at buckets instead of all nodes
+def _resize_selection(adjacency, selected, subgraph_size, target_and):
+    num_nodes = len(adjacency)
+    member = [False] * num_nodes
+    for i in selected:
+        member[i] = True
+
+    # links[i] is the number of selected neighbors of node i
+    links = [sum(1 for j in adjacency[i] if member[j]) for i in range(num_nodes)]
+    edges = sum(links[i] for i in selected) // 2
+    size = len(selected)
+
+    # Candidates are the unselected nodes when growing, the selected ones otherwise
+    growing = size < subgraph_size
+    buckets = {}
+    for i in range(num_nodes):
+        if member[i] != growing:
+            buckets.setdefault(links[i], set()).add(i)
+
+    while size != subgraph_size:
+        new_size = size + 1 if growing else size - 1
+
+        # Link count that would put the average node degree exactly on target
+        wanted = target_and * new_size / 2 - edges
+        if not growing:
+            wanted = -wanted
+        count = min(buckets, key=lambda c: (abs(c - wanted), c))
+
+        bucket = buckets[count]
+        best_node = bucket.pop()
+        if not bucket:
+            del buckets[count]
+
+        member[best_node] = growing
+        edges = edges + count if growing else edges - count
+        step = 1 if growing else -1
+        for j in adjacency[best_node]:
+            if member[j] != growing:
+                # Move the candidate neighbor to its new bucket
+                bucket = buckets[links[j]]
+                bucket.remove(j)
+                if not bucket:
+                    del buckets[links[j]]
+                buckets.setdefault(links[j] + step, set()).add(j)
+            links[j] += step
+        size = new_size
+
+    return [i for i in range(num_nodes) if member[i]]
+
+
+# Average node degree of the subgraph induced by the selected node indices
+def _selection_average_degree(adjacency, selected):
+    member = set(selected)
+    links = sum(1 for i in selected for j in adjacency[i] if j in member)
+    return links / float(len(selected))
+
+
+# Anneal a single subgraph size, cold or warm started from an initial node set
+# Warm starts begin at a lower temperature so the chain refines the initial set
+# instead of randomizing it
+def _search_size(
+    adjacency,
+    adjacency_matrix,
+    target_and,
+    subgraph_size,
+    initial,
+    num_chains,
+    seed,
+    warm_temperature,
+    deadline,
+):
+    initial_temperature = 100 if initial is None else warm_temperature
+
+    if num_chains is None:
+        selected, _ = _anneal(
+            adjacency,
+            target_and,
+            subgraph_size,
+            initial_temperature,
+            0.99,
+            1e-6,
+            max_rejections=10,
+            rng=random.Random(seed),
+            initial=initial,
+            deadline=deadline,
+        )
+    else:
+        selected, _ = _anneal_chains(
+            adjacency_matrix,
+            target_and,
+            subgraph_size,
+            num_chains,
+            initial_temperature,
+            0.99,
+            1e-6,
+            np.random.default_rng(seed),
+            initial=initial,
+            deadline=deadline,
+        )
+
+    return selected
+
+
+# Smallest average node degree distance to target_and reachable with an induced
+# edge count between lower and upper
+def _edge_range_objective(lower, upper, subgraph_size, target_and):
+    ideal = target_and * subgraph_size / 2
+    closest = [min(max(e, lower), upper) for e in (math.floor(ideal), math.ceil(ideal))]
+    return min(abs(2 * e / subgraph_size - target_and) for e in closest)
+
+
+# Exact search for the subgraph of a given size with at least min_edges edges
+# and closest average node degree to target_and
+# Branch and bound over node sets, pruning with bounds on the final edge count;
+# returns (selected indices, objective), or (None, inf) when no subgraph qualifies;
+# once time.perf_counter() passes deadline the best subgraph so far is returned
+def _exact_search(adjacency, target_and, subgraph_size, min_edges, deadline=None):
+    num_nodes = len(adjacency)
+
+    # Visit high degree nodes first so good subgraphs are found early
+    order = sorted(range(num_nodes), key=lambda i: -len(adjacency[i]))
+
+    # links[i] is the number of chosen neighbors of node i
+    links = [0] * num_nodes
+    chosen = []
+    best = [None, math.inf]
+
+    def branch(start, edges):
+        remaining = subgraph_size - len(chosen)
+        if remaining == 0:
+            objective = abs(2 * edges / subgraph_size - target_and)
+            if edges >= min_edges and objective < best[1]:
+                best[0] = list(chosen)
+                best[1] = objective
+            return
+
+        if deadline is not None and time.perf_counter() > deadline:
+            return
+
+        # Every added node brings at least its current links and at most its
+        # current links plus one edge to each node added after it
+        gains = sorted(links[i] for i in order[start:])
+        lower = edges + sum(gains[:remaining])
+        upper = edges + sum(gains[-remaining:]) + remaining * (remaining - 1) // 2
+        if upper < min_edges:
+            return
+        if (
+            _edge_range_objective(
+                max(lower, min_edges), upper, subgraph_size, target_and
+            )
+            >= best[1]
+        ):
+            return
+
+        for pos in range(start, num_nodes - remaining + 1):
+            i = order[pos]
+            chosen.append(i)
+            for j in adjacency[i]:
+                links[j] += 1
+
+            branch(pos + 1, edges + links[i])
+
+            chosen.pop()
+            for j in adjacency[i]:
+                links[j] -= 1
+
+    branch(0, 0)
+    return best[0], best[1]
+
+
+# Exact Red-QAOA reduction for small graphs
+# Finds the minimum node count whose best subgraph meets and_ratio, and among
+# those subgraphs the one with closest average node degree to the original graph
+def _red_qaoa_exact(graph, and_ratio, deadline=None):
+    nodes, adjacency = _index_graph(graph)
+    num_nodes = len(nodes)
+    and_base = average_node_degree(graph)
+
+    for size in range(1, num_nodes):
+        # Fewest induced edges for which the subgraph meets and_ratio
+        min_edges = next(
+            (
+                e
+                for e in range(size * (size - 1) // 2 + 1)
+                if (2 * e / size) / and_base > and_ratio
+            ),
+            None,
+        )
+        if min_edges is None:
+            continue
+
+        selected, _ = _exact_search(
+            adjacency, and_base, size, min_edges, deadline=deadline
+        )
+        if selected is not None:
+            return nodes, selected
+
+        if deadline is not None and time.perf_counter() > deadline:
+            # Out of time, greedily drop a single node instead
+            selected = _resize_selection(
+                adjacency, list(range(num_nodes)), num_nodes - 1, and_base
+            )
+            return nodes, selected
+
+    # Like the binary search, fall back to the largest proper subgraph
+    selected, _ = _exact_search(adjacency, and_base, num_nodes - 1, 0)
+    return nodes, selected
+
+
+# Binary search over subgraph sizes behind red_qaoa_exe
+# The search starts from the peeling core, so the best subgraph found so far is
+# a real reduction whenever the deadline cuts it short; under a deadline that
+# subgraph is built up front and its build time reserved for the final build
+# Returns the graph's node list, the indices of the selected nodes, the reduced
+# graph and whether the deadline cut the search short
+def _red_qaoa_search(
+    graph, and_ratio, num_chains, probes, executor, seed, warm_temperature, deadline
+):
+    rng = random.Random(seed)
+    nodes, adjacency = _index_graph(graph)
+
     num_nodes = graph.number_of_nodes()
 
     and_base = average_node_degree(graph)
 
-    # Binary search for the minimum node count
+    # Best node set found for every probed size
+    results = {}
+
+    def search(sizes):
+        sizes = [size for size in sizes if size not in results]
+        args = []
+        for size in sizes:
+            # Probe no further sizes when out of time
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+
+            initial = None
+            if results:
+                nearest = min(results, key=lambda known: abs(known - size))
+                initial = _resize_selection(
+                    adjacency, results[nearest], size, and_base
+                )
+            args.append(
+                (
+                    adjacency,
+                    adjacency_matrix,
+                    and_base,
+                    size,
+                    initial,
+                    num_chains,
+                    rng.getrandbits(32),
+                    warm_temperature,
+                    deadline,
+                )
+            )
+
+        if executor is None or len(args) < 2:
+            selections = [_search_size(*arg) for arg in args]
+        else:
+            selections = list(executor.map(_search_size, *zip(*args)))
+
+        results.update(zip(sizes, selections))
+
+    def feasible(size):
+        and_sub = _selection_average_degree(adjacency, results[size])
+        return (and_sub / and_base) > and_ratio
+
+    # Binary search for the minimum node count, below the peeling core if any
     lower = 1
     upper = num_nodes - 1
-    best_subgraph = sa_adapt(graph, upper)
-
+    best_size = upper
+    indptr = np.concatenate(([0], np.cumsum([len(nbrs) for nbrs in adjacency])))
+    indices = [j for neighbors in adjacency for j in neighbors]
+    order, core_size = _peeling_core(indptr.tolist(), indices, and_base, and_ratio)
+    if core_size is not None:
+        best_size = core_size
+        upper = best_size - 1
+        results[best_size] = order[num_nodes - best_size :].tolist()
+
+    adjacency_matrix = None
+    if num_chains is not None:
+        adjacency_matrix = nx.to_numpy_array(graph, nodelist=nodes, dtype=np.int8)
+
+    if best_size not in results:
+        search([upper])
+    if best_size not in results:
+        # Out of time before the first probe, greedily drop a single node
+        results[best_size] = _resize_selection(
+            adjacency, list(range(num_nodes)), best_size, and_base
+        )
+
+    red_graph = None
+    if deadline is not None:
+        # Build the best subgraph so far now, leaving as much time to build a
+        # smaller one at the end
+        start = time.perf_counter()
+        red_graph = _induced_subgraph(graph, nodes, results[best_size])
+        deadline -= time.perf_counter() - start
+        built_size = best_size
+
+    timed_out = False
     while lower <= upper:
-        mid = (lower + upper) // 2
-        # Use the sa_adapt function to generate the subgraph with closest average node degree to the original graph
-        subgraph = sa_adapt(graph, mid)
-
-        and_sub = average_node_degree(subgraph)
-        if (and_sub / and_base) > and_ratio:
-            best_subgraph = subgraph
-            upper = mid - 1
-        else:
+        # Keep the smallest qualifying subgraph found when out of time
+        if deadline is not None and time.perf_counter() > deadline:
+            timed_out = True
+            break
+
+        # Split the remaining range evenly between the probed sizes
+        span = upper - lower
+        mids = sorted({lower + span * j // (probes + 1) for j in range(1, probes + 1)})
+        # Use the search function to generate the subgraph with closest average node degree to the original graph
+        search(mids)
+
+        for mid in mids:
+            if mid not in results:
+                break
+            if feasible(mid):
+                best_size = mid
+                upper = mid - 1
+                break
             lower = mid + 1
 
-    return best_subgraph
+    if red_graph is None or best_size != built_size:
+        red_graph = _induced_subgraph(graph, nodes, results[best_size])
+
+    return nodes, results[best_size], red_graph, timed_out
+
+
+# Red-QAOA algorithm for reducing the graph size for QAOA
+# Set num_chains to run the multi-chain sa_multi instead of sa_adapt at each size
+# Every probed size is memoized and warm started from the nearest size found so far;
+# probes > 1 searches several sizes per round, concurrently when an executor is given
+# Pass a ReductionCache as cache to reuse reductions across runs, and full_output=True
+# to also get a dict with the mapping from reduced node to original node
+# method is "exact" for branch and bound, "sa" for simulated annealing, or "auto"
+# to solve graphs with at most exact_max_nodes nodes exactly
+# deadline_ms bounds the wall-clock time, returning the best subgraph found so far;
+# the full_output dict also reports the achieved average node degree ratio and
+# whether the deadline was hit
+def red_qaoa_exe(
+    graph,
+    and_ratio=0.75,
+    num_chains=None,
+    probes=1,
+    executor=None,
+    seed=None,
+    warm_temperature=1e-2,
+    cache=None,
+    full_output=False,
+    method="auto",
+    exact_max_nodes=16,
+    deadline_ms=None,
+):
+    deadline = None
+    if deadline_ms is not None:
+        deadline = time.perf_counter() + deadline_ms / 1000
+
+    if method == "auto":
+        method = "exact" if graph.number_of_nodes() <= exact_max_nodes else "sa"
+    elif method not in ("exact", "sa"):
+        raise RuntimeError("Unrecognized reduction method")
+
+    settings = {"method": method}
+    if method == "sa":
+        settings["num_chains"] = num_chains
+        settings["probes"] = probes
+        settings["warm_temperature"] = warm_temperature
+
+    cached = None
+    timed_out = False
+    if cache is not None:
+        cached = cache.get(graph, and_ratio, seed, **settings)
+
+    if cached is not None:
+        red_graph, mapping = cached
+    else:
+        if method == "exact":
+            nodes, selected = _red_qaoa_exact(graph, and_ratio, deadline=deadline)
+            red_graph = _induced_subgraph(graph, nodes, selected)
+        else:
+            nodes, selected, red_graph, timed_out = _red_qaoa_search(
+                graph,
+                and_ratio,
+                num_chains,
+                probes,
+                executor,
+                seed,
+                warm_temperature,
+                deadline,
+            )
+
+        mapping = {k: v for k, v in enumerate(nodes[i] for i in sorted(selected))}
+        timed_out = timed_out or (
+            deadline is not None and time.perf_counter() > deadline
+        )
+
+        # Results cut short by the deadline are not worth reusing
+        if cache is not None and not timed_out:
+            cache.put(graph, and_ratio, seed, red_graph, mapping, **settings)
+
+    if full_output:
+        return red_graph, {
+            "mapping": mapping,
+            "and_ratio": average_node_degree(red_graph) / average_node_degree(graph),
+            "timed_out": timed_out,
+        }
+
+    return red_graph
+
+
+# Symmetric 0/1 CSR adjacency without self loops
+def _binary_csr(adjacency):
+    adjacency = sp.csr_matrix(adjacency)
+    upper = sp.triu(adjacency + adjacency.T, k=1, format="csr")
+    upper.eliminate_zeros()
+    upper.data = np.ones_like(upper.data, dtype=np.int8)
+    return (upper + upper.T).tocsr()
+
+
+# Minimum degree peeling order of a CSR graph (Batagelj-Zaversnik, O(n + m))
+# Every suffix of the order is a nested, increasingly dense core of the graph
+def _peeling_order(indptr, indices):
+    num_nodes = len(indptr) - 1
+    degree = [indptr[i + 1] - indptr[i] for i in range(num_nodes)]
+    max_degree = max(degree, default=0)
+
+    # Bucket sort the nodes by degree
+    bin_start = [0] * (max_degree + 1)
+    for d in degree:
+        bin_start[d] += 1
+    start = 0
+    for d in range(max_degree + 1):
+        bin_start[d], start = start, start + bin_start[d]
+
+    position = [0] * num_nodes
+    order = [0] * num_nodes
+    for v in range(num_nodes):
+        position[v] = bin_start[degree[v]]
+        order[position[v]] = v
+        bin_start[degree[v]] += 1
+    for d in range(max_degree, 0, -1):
+        bin_start[d] = bin_start[d - 1]
+    bin_start[0] = 0
+
+    for i in range(num_nodes):
+        v = order[i]
+        for u in indices[indptr[v] : indptr[v + 1]]:
+            if degree[u] > degree[v]:
+                # Move u to the front of its bin and lower its degree
+                du = degree[u]
+                pu = position[u]
+                pw = bin_start[du]
+                w = order[pw]
+                if u != w:
+                    position[u], position[w] = pw, pu
+                    order[pu], order[pw] = w, u
+                bin_start[du] += 1
+                degree[u] -= 1
+
+    return order
+
+
+# Minimum degree peeling order of a CSR graph and the size of its smallest core,
+# a suffix of the order, that meets and_ratio; None if no proper core does
+def _peeling_core(indptr, indices, and_base, and_ratio):
+    num_nodes = len(indptr) - 1
+    order = np.array(_peeling_order(indptr, indices), dtype=np.int64)
+    rank = np.empty(num_nodes, dtype=np.int64)
+    rank[order] = np.arange(num_nodes)
+
+    # Each edge belongs to every suffix of the order containing its earlier node
+    rows = np.repeat(np.arange(num_nodes), np.diff(indptr))
+    cols = np.array(indices, dtype=np.int64)
+    first = np.minimum(rank[rows], rank[cols])[rows < cols]
+    suffix_sizes = np.arange(1, num_nodes)
+    suffix_edges = np.cumsum(np.bincount(num_nodes - 1 - first, minlength=num_nodes))
+    suffix_and = 2 * suffix_edges[: num_nodes - 1] / suffix_sizes
+
+    feasible = np.flatnonzero(suffix_and / and_base > and_ratio)
+    if not len(feasible):
+        return order, None
+    return order, int(suffix_sizes[feasible[0]])
+
+
+# Red-QAOA for large graphs given as a SciPy sparse adjacency matrix
+# Instead of a binary search with annealing at every size, one minimum degree
+# peeling pass yields the induced edge count of every nested core, so the
+# smallest core meeting and_ratio is found in O(n + m); annealing on the CSR
+# adjacency then refines that core towards the original average node degree
+# Returns the reduced graph as an (m', 2) edge array over nodes 0, 1, 2, ...
+# and the original indices of those nodes
+def red_qaoa_sparse(adjacency, and_ratio=0.75, refine=True, seed=None, deadline_ms=None):
+    deadline = None
+    if deadline_ms is not None:
+        deadline = time.perf_counter() + deadline_ms / 1000
+
+    adjacency = _binary_csr(adjacency)
+    num_nodes = adjacency.shape[0]
+    indptr = adjacency.indptr.tolist()
+    indices = adjacency.indices.tolist()
+
+    and_base = adjacency.nnz / num_nodes
+
+    order, subgraph_size = _peeling_core(indptr, indices, and_base, and_ratio)
+    if subgraph_size is None:
+        subgraph_size = num_nodes - 1
+    selected = order[num_nodes - subgraph_size :].tolist()
+
+    if refine and subgraph_size < num_nodes:
+        node_adjacency = [indices[indptr[i] : indptr[i + 1]] for i in range(num_nodes)]
+        selected, _ = _anneal(
+            node_adjacency,
+            and_base,
+            subgraph_size,
+            1e-2,
+            0.99,
+            1e-6,
+            max_rejections=10,
+            rng=random.Random(seed),
+            initial=selected,
+            deadline=deadline,
+        )
+
+    nodes = np.sort(np.array(selected, dtype=np.int64))
+    subgraph = sp.triu(adjacency[nodes][:, nodes], k=1).tocoo()
+
+    return np.column_stack((subgraph.row, subgraph.col)), nodes
+
+
+# Reduce one graph and time it, run inside red_qaoa_batch workers
+def _timed_reduction(graph, and_ratio, seed, kwargs):
+    start = time.perf_counter()
+    red_graph = red_qaoa_exe(graph, and_ratio, seed=seed, **kwargs)
+    return red_graph, time.perf_counter() - start
+
+
+# Red-QAOA over a list of graphs on a process pool
+# Every graph gets its own seed derived from seed and the graph's content, so a
+# graph is reduced the same way regardless of its position in the list;
+# results are yielded as (index, reduced graph, seconds) in completion order
+def red_qaoa_batch(graphs, and_ratio=0.75, workers=None, seed=None, **kwargs):
+    entropy = np.random.SeedSequence(seed).entropy
+    seeds = [
+        int(
+            np.random.SeedSequence([entropy, int(graph_hash(graph)[:16], 16)])
+            .generate_state(1)[0]
+        )
+        for graph in graphs
+    ]
+
+    if workers == 1:
+        for i, (graph, task_seed) in enumerate(zip(graphs, seeds)):
+            yield (i, *_timed_reduction(graph, and_ratio, task_seed, kwargs))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_timed_reduction, graph, and_ratio, task_seed, kwargs): i
+            for i, (graph, task_seed) in enumerate(zip(graphs, seeds))
+        }
+        for future in as_completed(futures):
+            yield (futures[future], *future.result())
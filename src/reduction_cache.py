@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+
+import networkx as nx
+
+from graph_util import graph_hash
+from io_util import atomic_write
+
+
+class ReductionCache:
+    """
+    Persistent on-disk cache of Red-QAOA reductions
+
+    Entries are keyed by a content hash of the graph together with the
+    reduction settings, and store the reduced graph and the mapping from
+    reduced node to original node. The least recently used entries are
+    evicted once more than max_entries are stored.
+
+    Args:
+        directory: str
+                   cache directory, created on first write
+
+        max_entries: int
+                     maximum number of stored reductions
+
+        enabled: bool
+                 bypass the cache entirely when False, also disabled by
+                 setting the RED_QAOA_NO_CACHE environment variable
+    """
+
+    def __init__(self, directory=".red_qaoa_cache", max_entries=4096, enabled=True):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.enabled = enabled and not os.environ.get("RED_QAOA_NO_CACHE")
+
+    def key(self, graph, and_ratio, seed, **settings):
+        payload = json.dumps(
+            [graph_hash(graph), and_ratio, seed, sorted(settings.items())],
+            default=repr,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, graph, and_ratio, seed, **settings):
+        """
+        Returns (reduced graph, mapping) or None on a miss
+        """
+        if not self.enabled:
+            return None
+
+        path = self._path(self.key(graph, and_ratio, seed, **settings))
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        # Mark the entry as recently used, unless it was just evicted
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+        red_graph = nx.Graph()
+        red_graph.add_nodes_from(range(entry["num_nodes"]))
+        red_graph.add_edges_from(entry["edges"])
+        mapping = {reduced: original for reduced, original in entry["mapping"]}
+
+        return red_graph, mapping
+
+    def put(self, graph, and_ratio, seed, red_graph, mapping, **settings):
+        if not self.enabled:
+            return
+
+        entry = {
+            "num_nodes": red_graph.number_of_nodes(),
+            "edges": [list(edge) for edge in red_graph.edges()],
+            "mapping": [[reduced, original] for reduced, original in mapping.items()],
+        }
+
+        atomic_write(
+            self._path(self.key(graph, and_ratio, seed, **settings)),
+            lambda f: json.dump(entry, f),
+        )
+
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                path = os.path.join(self.directory, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except FileNotFoundError:
+                    continue
+
+        entries.sort()
+        for _, path in entries[: max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass